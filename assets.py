@@ -0,0 +1,140 @@
+from __future__ import annotations
+import os
+import re
+import json
+import hashlib
+import mimetypes
+import threading
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+
+from catalog import Encoded
+
+FRONTEND_DIR = "frontend"
+STATIC_PREFIX = "/static/"
+# ملفات تأخذ بصمة في اسمها (style.<hash>.css)؛ sw.js يبقى باسمه الثابت
+FINGERPRINT_EXTS = (".css", ".js")
+SERVICE_WORKER = "sw.js"
+HASH_CHARS = 10
+
+# الملف ذو البصمة لا يتغير محتواه أبداً، والصفحات و sw.js تُراجع مع السيرفر في كل زيارة (304 غالباً)
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# سطر المانيفست في sw.js يُستبدل عند البناء (القيمة الافتراضية في الملف تكفي للتطوير)
+_SW_MANIFEST = re.compile(r"^const ASSET_MANIFEST = .*;$", re.M)
+
+
+class Asset:
+    __slots__ = ("body", "version", "media_type", "cache_control", "_encoded")
+
+    def __init__(self, body: bytes, media_type: str, version: str, cache_control: str):
+        self.body, self.version = body, version
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self._encoded: Optional[Encoded] = None
+
+    @property
+    def encoded(self) -> Encoded:
+        # نفس Encoded الخاص بالكتالوج: gzip/brotli مرة واحدة عند أول طلب للملف وليس أثناء الإقلاع
+        if self._encoded is None: self._encoded = Encoded(self.body, self.version)
+        return self._encoded
+
+    def response(self, headers: Headers) -> Response:
+        encoded = self.encoded
+        encoding, data, etag = encoded.pick(headers.get("accept-encoding"))
+        out = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if encoded.matches(headers.get("if-none-match")):
+            return Response(status_code=304, headers=out)
+        if encoding != "identity": out["Content-Encoding"] = encoding
+        return Response(data, media_type=self.media_type, headers=out)
+
+
+def _media_type(name: str) -> str:
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    return media_type + "; charset=utf-8" if media_type.startswith("text/") or name.endswith(".js") else media_type
+
+
+class AssetStore:
+    """يبني عند الإقلاع: أسماء ببصمة المحتوى للـ CSS/JS، صفحات HTML بروابط معدلة، و sw.js بقائمة precache.
+
+    الضغط نفسه مؤجل لأول طلب لكل ملف (ثم يُعاد نفس البايتات)، فلا يطيل إقلاع الـ worker.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.version = ""
+        self.urls: Dict[str, str] = {}       # /static/style.css -> /static/style.<hash>.css
+        self.files: Dict[str, Asset] = {}    # المسار المطلوب -> Asset
+        self._lock = threading.Lock()
+        self._built = False
+
+    def build(self) -> None:
+        with self._lock:
+            urls, files = {}, {}
+            names = sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []
+            for name in names:
+                if name == SERVICE_WORKER or not name.endswith(FINGERPRINT_EXTS): continue
+                with open(os.path.join(self.root, name), "rb") as f: body = f.read()
+                digest = hashlib.sha256(body).hexdigest()[:HASH_CHARS]
+                stem, ext = os.path.splitext(name)
+                url = f"{STATIC_PREFIX}{stem}.{digest}{ext}"
+                urls[STATIC_PREFIX + name] = url
+                files[url] = Asset(body, _media_type(name), digest, IMMUTABLE)
+            version = hashlib.sha256(" ".join(sorted(urls.values())).encode()).hexdigest()[:HASH_CHARS]
+
+            # /static/ramallah.js?v=2 -> /static/ramallah.<hash>.js (البصمة تغني عن ?v=)
+            refs = re.compile("(?:" + "|".join(re.escape(u) for u in sorted(urls, key=len, reverse=True)) + r")(?:\?[\w.=&-]*)?") if urls else None
+            for name in names:
+                if not name.endswith(".html"): continue
+                with open(os.path.join(self.root, name), encoding="utf-8") as f: html = f.read()
+                if refs: html = refs.sub(lambda m: urls[m.group(0).split("?")[0]], html)
+                body = html.encode("utf-8")
+                files[STATIC_PREFIX + name] = Asset(body, "text/html; charset=utf-8", hashlib.sha256(body).hexdigest()[:HASH_CHARS], REVALIDATE)
+
+            if SERVICE_WORKER in names:
+                with open(os.path.join(self.root, SERVICE_WORKER), encoding="utf-8") as f: sw = f.read()
+                manifest = json.dumps({"version": version, "urls": ["/", *sorted(urls.values())]})
+                body = _SW_MANIFEST.sub(lambda _: f"const ASSET_MANIFEST = {manifest};", sw).encode("utf-8")
+                files["/" + SERVICE_WORKER] = Asset(body, _media_type(SERVICE_WORKER), version, REVALIDATE)
+
+            self.urls, self.files, self.version, self._built = urls, files, version, True
+        print(f"--- [OK] Assets built: {len(urls)} fingerprinted, version {version} ---")
+
+    def get(self, path: str) -> Optional[Asset]:
+        if not self._built: self.build()
+        return self.files.get(path)
+
+    def page(self, name: str, headers: Headers) -> Response:
+        asset = self.get(STATIC_PREFIX + name)
+        if asset is None: raise HTTPException(status_code=404)
+        return asset.response(headers)
+
+    def service_worker(self, headers: Headers) -> Response:
+        asset = self.get("/" + SERVICE_WORKER)
+        if asset is None: raise HTTPException(status_code=404)
+        return asset.response(headers)
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles مع Cache-Control؛ وإن أُعطي store يخدم منه الملفات ذات البصمة والصفحات المعدلة أولاً."""
+
+    def __init__(self, *, store: Optional[AssetStore] = None, cache_control: str = REVALIDATE, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.cache_control = cache_control
+
+    async def get_response(self, path: str, scope) -> Response:
+        if self.store is not None:
+            asset = self.store.get(STATIC_PREFIX + path.replace(os.sep, "/"))
+            if asset is not None: return asset.response(Headers(scope=scope))
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304): response.headers.setdefault("Cache-Control", self.cache_control)
+        return response
+
+
+asset_store = AssetStore(FRONTEND_DIR)
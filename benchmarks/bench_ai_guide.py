@@ -0,0 +1,148 @@
+"""مقارنة سياق /api/ai-guide: كل الأماكن (السلوك القديم) مقابل أفضل k من retrieval.py.
+
+يقيس حجم الطلب (رموز تقريبية، أو دقيقة إن كانت tiktoken مثبتة) وزمن التجهيز محلياً.
+مع --live و OPENAI_API_KEY يقيس أيضاً زمن رد النموذج الفعلي للطريقتين.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.bench_ai_guide
+    python -m benchmarks.bench_ai_guide --sizes 100 1000 --live
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+from retrieval import GuideIndex, build_context
+
+try:
+    import tiktoken
+    _enc = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _enc = None
+
+QUESTIONS = [
+    "وين في مطعم شاورما طيب بالبيرة؟",
+    "بدي كافيه هادي للدراسة قريب من المنارة",
+    "اقترح علي صالة رياضية للنساء",
+    "مين أحسن محل حلويات كنافة في رام الله؟",
+    "فندق مناسب للعائلات",
+]
+
+_KINDS = [
+    ("مطعم", "مطاعم", ["شاورما", "مشاوي", "فلافل", "منسف", "بيتزا"]),
+    ("مقهى", "مقاهي", ["قهوة", "دراسة", "هادئ", "واي فاي", "أرجيلة"]),
+    ("حلويات", "حلويات", ["كنافة", "بقلاوة", "كيك", "بوظة"]),
+    ("نادي", "رياضة", ["لياقة", "نساء", "سباحة", "كروس فت"]),
+    ("فندق", "فنادق", ["عائلات", "مسبح", "إفطار", "قاعة"]),
+]
+_NAMES = ["الأصيل", "النخبة", "الياسمين", "القدس", "البلد", "الزيتونة", "السلطان", "الريف", "المدينة", "الشرق"]
+_AREAS = ["رام الله التحتا", "البيرة", "المنارة", "الطيرة", "الماصيون", "بيتونيا", "الإرسال", "عين منجد"]
+
+
+def _fake_places(n: int) -> list:
+    rnd = random.Random(n)
+    rows = []
+    for i in range(1, n + 1):
+        kind, cat, tags = rnd.choice(_KINDS)
+        picked = rnd.sample(tags, 2)
+        rows.append({
+            "id": i,
+            "name": f"{kind} {rnd.choice(_NAMES)} {i}",
+            "category": cat,
+            "area": rnd.choice(_AREAS),
+            "tags": "، ".join(picked),
+            "description": f"{kind} في قلب المدينة يقدم {picked[0]} و{picked[1]} بأسعار مناسبة وخدمة ممتازة طوال أيام الأسبوع. " * 2,
+            "is_premium": rnd.random() < 0.1,
+        })
+    return rows
+
+
+def _old_context(rows: list) -> str:
+    # نفس بناء السياق قبل retrieval: كل مكان فعال بوصفه الكامل
+    return "\n".join(f"- {p['name']}: في {p['area']}, {p['description']}" for p in rows)
+
+
+def _tokens(text: str) -> int:
+    # بدون tiktoken: تقدير تقريبي (النص العربي ~2.5 حرف لكل رمز)
+    return len(_enc.encode(text)) if _enc else round(len(text) / 2.5)
+
+
+def _system(context: str) -> str:
+    return f"أنت مساعد رام الله تايم. استخدم البيانات: {context}"
+
+
+async def _live_latency(prompts: list) -> float:
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    times = []
+    for system, question in prompts:
+        t0 = time.perf_counter()
+        await client.chat.completions.create(
+            model="gpt-4o", messages=[{"role": "system", "content": system}, {"role": "user", "content": question}]
+        )
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000
+
+
+def run(n: int, k: int, live: bool) -> dict:
+    rows = _fake_places(n)
+    index = GuideIndex()
+    t0 = time.perf_counter()
+    index.sync(rows, version=1)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    old_prompts = [(_system(_old_context(rows)), q) for q in QUESTIONS]
+    old_ms = (time.perf_counter() - t0) * 1000 / len(QUESTIONS)
+    t0 = time.perf_counter()
+    new_prompts = [(_system(build_context(index.search(q, k))), q) for q in QUESTIONS]
+    new_ms = (time.perf_counter() - t0) * 1000 / len(QUESTIONS)
+
+    # تعديل مكان واحد: يُعاد تحليله وحده
+    rows[0] = {**rows[0], "description": "تم تحديث الوصف"}
+    t0 = time.perf_counter()
+    changed = index.sync(rows, version=2)
+    update_ms = (time.perf_counter() - t0) * 1000
+
+    result = {
+        "n": n,
+        "old_tokens": statistics.mean(_tokens(s) for s, _ in old_prompts),
+        "new_tokens": statistics.mean(_tokens(s) for s, _ in new_prompts),
+        "old_prepare_ms": old_ms,
+        "new_prepare_ms": new_ms,
+        "index_build_ms": build_ms,
+        "sync_one_change_ms": update_ms,
+        "sync_reanalyzed": changed,
+    }
+    if live:
+        result["old_model_ms"] = asyncio.run(_live_latency(old_prompts))
+        result["new_model_ms"] = asyncio.run(_live_latency(new_prompts))
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("-k", type=int, default=8)
+    parser.add_argument("--live", action="store_true", help="استدعاء OpenAI فعلياً (يتطلب OPENAI_API_KEY)")
+    args = parser.parse_args()
+    live = args.live and bool(os.environ.get("OPENAI_API_KEY"))
+    if args.live and not live: print("OPENAI_API_KEY غير موجود: تخطي قياس زمن النموذج")
+
+    print(f"tokens: {'tiktoken' if _enc else 'estimate (chars/2.5)'}")
+    header = f"{'places':>8} {'old tokens':>11} {'new tokens':>11} {'old prep ms':>12} {'new prep ms':>12} {'build ms':>10} {'sync 1 ms':>10}"
+    if live: header += f" {'old model ms':>13} {'new model ms':>13}"
+    print(header)
+    for n in args.sizes:
+        r = run(n, args.k, live)
+        line = (f"{r['n']:>8} {r['old_tokens']:>11.0f} {r['new_tokens']:>11.0f} {r['old_prepare_ms']:>12.2f} "
+                f"{r['new_prepare_ms']:>12.2f} {r['index_build_ms']:>10.1f} {r['sync_one_change_ms']:>10.1f}")
+        if live: line += f" {r['old_model_ms']:>13.0f} {r['new_model_ms']:>13.0f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
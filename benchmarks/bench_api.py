@@ -0,0 +1,366 @@
+"""اختبار حمل للـ API داخل نفس العملية (بدون سيرفر أو شبكة) على بيانات صناعية.
+
+لكل حجم (1k / 10k / 100k مكان) تُنشأ قاعدة SQLite مؤقتة في عملية منفصلة، ثم تُشغل
+السيناريوهات عبر ASGI مباشرة مع بديل محلي لـ OpenAI، ويُطبع p50/p95/p99 والإنتاجية
+وتُحفظ النتائج JSON للمقارنة بين الـ commits.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.bench_api
+    python -m benchmarks.bench_api --sizes 1000 --requests 100 --concurrency 4
+    python -m benchmarks.bench_api --scenarios listing search nearby
+    python -m benchmarks.bench_api --compare benchmarks/results/<old>.json
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# مركز رام الله تقريباً (نفس bench_distance)
+CENTER = (31.9038, 35.2034)
+SPREAD_DEG = 0.08
+OWNER_ACCOUNTS = 20
+OWNER_PASSWORD = "bench-password"
+
+SCENARIOS = ("listing", "search", "nearby", "owner_login", "image_upload", "ai_guide", "ai_scan")
+
+_KINDS = [
+    ("مطعم", "مطاعم", ["شاورما", "مشاوي", "فلافل", "منسف", "بيتزا"]),
+    ("مقهى", "مقاهي", ["قهوة", "دراسة", "هادئ", "أرجيلة"]),
+    ("حلويات", "حلويات", ["كنافة", "بقلاوة", "كيك", "بوظة"]),
+    ("نادي", "رياضة", ["لياقة", "سباحة", "كروس فت"]),
+    ("فندق", "فنادق", ["عائلات", "مسبح", "قاعة"]),
+    ("صيدلية", "صحة", ["أدوية", "مناوبة", "تجميل"]),
+]
+_NAMES = ["الأصيل", "النخبة", "الياسمين", "القدس", "البلد", "الزيتونة", "السلطان", "الريف", "المدينة", "الشرق", "الأمل", "البيادر"]
+_AREAS = ["رام الله التحتا", "البيرة", "المنارة", "الطيرة", "الماصيون", "بيتونيا", "الإرسال", "عين منجد", "سردا"]
+
+
+# --- تجهيز البيانات (داخل العملية الفرعية) ---
+def _seed(n: int, rnd: random.Random) -> None:
+    from database import engine, init_db, Place, PlaceImage
+    import security
+
+    init_db()
+    now = datetime.utcnow()
+    hashes = [security.hash_password(OWNER_PASSWORD) for _ in range(OWNER_ACCOUNTS)]
+    places, images = [], []
+    for i in range(1, n + 1):
+        kind, cat, tags = rnd.choice(_KINDS)
+        picked = rnd.sample(tags, 2)
+        roll = rnd.random()
+        # 85% فعال، 10% بانتظار التفعيل، 5% منتهي
+        status, end = ("active", now + timedelta(days=rnd.randint(1, 365)))
+        if roll > 0.95: status, end = ("expired", now - timedelta(days=rnd.randint(1, 60)))
+        elif roll > 0.85: status, end = ("pending", None)
+        if i <= OWNER_ACCOUNTS: status, end = ("active", now + timedelta(days=365))
+        places.append({
+            "id": i,
+            "name": f"{kind} {rnd.choice(_NAMES)} {i}",
+            "category": cat,
+            "area": rnd.choice(_AREAS),
+            "tags": "، ".join(picked),
+            "description": f"{kind} يقدم {picked[0]} و{picked[1]} بأسعار مناسبة وخدمة ممتازة.",
+            "phone": f"059{rnd.randint(1000000, 9999999)}",
+            "latitude": CENTER[0] + rnd.uniform(-SPREAD_DEG, SPREAD_DEG) if rnd.random() > 0.05 else None,
+            "longitude": CENTER[1] + rnd.uniform(-SPREAD_DEG, SPREAD_DEG),
+            "is_premium": rnd.random() < 0.1,
+            "subscription_status": status,
+            "subscription_start": now - timedelta(days=30) if end else None,
+            "subscription_end": end,
+            "owner_email": f"owner{i}@bench.local" if i <= OWNER_ACCOUNTS else None,
+            "owner_password": hashes[i - 1] if i <= OWNER_ACCOUNTS else None,
+            "created_at": now,
+        })
+        for j in range(rnd.randint(0, 3)):
+            images.append({"place_id": i, "image_url": f"/images/places/seed-{i}-{j}.jpg", "sort_order": j, "created_at": now})
+    # إدخال جماعي (Core) على دفعات: أسرع بكثير من ORM لعشرات الآلاف من الصفوف
+    with engine.begin() as conn:
+        for k in range(0, len(places), 5000): conn.execute(Place.__table__.insert(), places[k:k + 5000])
+        for k in range(0, len(images), 5000): conn.execute(PlaceImage.__table__.insert(), images[k:k + 5000])
+
+
+def _jpeg_bytes(w: int = 800, h: int = 600) -> bytes:
+    try:
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.effect_noise((w, h), 40).convert("RGB").save(buf, "JPEG", quality=85)
+        return buf.getvalue()
+    except ImportError:
+        # بدون Pillow: بايتات تبدأ بتوقيع JPEG (الحفظ يعمل، والنسخ المصغرة تُتخطى)
+        return b"\xff\xd8\xff\xe0" + os.urandom(64 * 1024)
+
+
+def _multipart(field: str, filename: str, data: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+# --- بديل OpenAI المحلي ---
+class _StubCompletions:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        json_mode = "response_format" in kwargs
+        content = '{"name": "مطعم تجريبي", "category": "مطاعم"}' if json_mode else "اقتراح تجريبي"
+        msg = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)])
+
+
+# --- عميل ASGI مباشر (بدون httpx أو شبكة) ---
+async def _call(app, method: str, path: str, body: bytes = b"", headers: dict = None) -> tuple:
+    """يعيد (status, البايتات، الزمن بالثواني)."""
+    path, _, query = path.partition("?")
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    raw_headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": quote(query, safe="=&").encode(),
+        "headers": raw_headers, "client": ("127.0.0.1", 50000), "server": ("bench", 80), "root_path": "",
+    }
+    sent = False
+    done = asyncio.Event()
+    result = {"status": 0, "body": [], "elapsed": None}
+    t0 = time.perf_counter()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            result["body"].append(message.get("body", b""))
+            if not message.get("more_body"):
+                # الزمن كما يراه العميل: حتى آخر بايت (المهام الخلفية بعدها لا تُحسب)
+                result["elapsed"] = time.perf_counter() - t0
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return result["status"], b"".join(result["body"]), result["elapsed"] or (time.perf_counter() - t0)
+
+
+class _Requests:
+    """يولد طلبات عشوائية (بذرة ثابتة) لكل سيناريو."""
+
+    def __init__(self, rnd: random.Random, tokens: list, owned: list):
+        self.rnd, self.tokens, self.owned = rnd, tokens, owned
+        self.image = _jpeg_bytes()
+        self.scan_images = [_jpeg_bytes(1600, 1200) for _ in range(3)]
+
+    def listing(self):
+        cat = self.rnd.choice(_KINDS)[1] if self.rnd.random() < 0.5 else None
+        return "GET", "/api/places?limit=20" + (f"&cat={cat}" if cat else ""), b"", {"accept-encoding": "gzip"}
+
+    def search(self):
+        q = self.rnd.choice([self.rnd.choice(_NAMES), self.rnd.choice(_KINDS)[0], self.rnd.choice(_KINDS)[2][0]])
+        return "GET", f"/api/places?limit=20&q={q}", b"", {}
+
+    def nearby(self):
+        lat = CENTER[0] + self.rnd.uniform(-SPREAD_DEG, SPREAD_DEG)
+        lng = CENTER[1] + self.rnd.uniform(-SPREAD_DEG, SPREAD_DEG)
+        return "GET", f"/api/places?limit=20&lat={lat:.5f}&lng={lng:.5f}", b"", {}
+
+    def owner_login(self):
+        i = self.rnd.randint(1, OWNER_ACCOUNTS)
+        body = json.dumps({"email": f"owner{i}@bench.local", "password": OWNER_PASSWORD}).encode()
+        return "POST", "/api/owner-login", body, {"content-type": "application/json"}
+
+    def image_upload(self):
+        k = self.rnd.randrange(len(self.owned))
+        body, ctype = _multipart("images", "photo.jpg", self.image)
+        return "POST", f"/api/places/{self.owned[k]}/images", body, {"content-type": ctype, "x-admin-token": self.tokens[k]}
+
+    def ai_guide(self):
+        msg = f"وين في {self.rnd.choice(_KINDS)[0]} {self.rnd.choice(_KINDS)[2][0]} في {self.rnd.choice(_AREAS)}؟"
+        return "POST", "/api/ai-guide", json.dumps({"message": msg}).encode(), {"content-type": "application/json"}
+
+    def ai_scan(self):
+        # نفس الصور تتكرر (مثل إعادة المحاولة)، فيظهر أثر الكاش
+        body, ctype = _multipart("image", "scan.jpg", self.rnd.choice(self.scan_images))
+        return "POST", "/api/ai-scan", body, {"content-type": ctype}
+
+
+async def _run_scenario(app, make, requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    queue = [make() for _ in range(requests)]
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            method, path, body, headers = queue.pop()
+            status, _, elapsed = await _call(app, method, path, body, headers)
+            latencies.append(elapsed)
+            if status >= 400: errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - t0
+    ms = np.array(latencies) * 1000
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "throughput_rps": requests / wall,
+    }
+
+
+async def _worker_main(args) -> dict:
+    rnd = random.Random(args.seed)
+    t0 = time.perf_counter()
+    _seed(args.size, rnd)
+    seed_s = time.perf_counter() - t0
+
+    import main
+    main.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_StubCompletions(args.stub_latency_ms / 1000)))
+    app = main.app
+    results = {}
+    async with main.app.router.lifespan_context(app):
+        # توكنات المالكين للرفع (من مسار الدخول نفسه)
+        tokens, owned = [], []
+        for i in range(1, OWNER_ACCOUNTS + 1):
+            body = json.dumps({"email": f"owner{i}@bench.local", "password": OWNER_PASSWORD}).encode()
+            status, data, _ = await _call(app, "POST", "/api/owner-login", body, {"content-type": "application/json"})
+            if status == 200:
+                tokens.append(json.loads(data)["token"])
+                owned.append(i)
+        gen = _Requests(rnd, tokens, owned)
+        for name in args.scenarios:
+            make = getattr(gen, name)
+            # إحماء: بناء الكاش والفهارس قبل القياس
+            await _run_scenario(app, make, min(20, args.requests), 1)
+            results[name] = await _run_scenario(app, make, args.requests, args.concurrency)
+            print(f"  {args.size:>7} {name:<13} p50 {results[name]['p50_ms']:8.2f}ms  p95 {results[name]['p95_ms']:8.2f}ms  "
+                  f"p99 {results[name]['p99_ms']:8.2f}ms  {results[name]['throughput_rps']:8.1f} req/s  errors {results[name]['errors']}",
+                  file=sys.stderr)
+    return {"size": args.size, "seed_seconds": seed_s, "scenarios": results}
+
+
+# --- المشغل: عملية منفصلة لكل حجم (قاعدة ومتغيرات بيئة مستقلة) ---
+def _run_size(size: int, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench-api-") as tmp:
+        out = os.path.join(tmp, "result.json")
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+            "OPENAI_API_KEY": "",
+            # نقيس كلفة المسارات نفسها، لا رفض الـ limiter لعميل واحد يرسل كل الطلبات
+            "RATE_LIMIT_ENABLED": "0",
+            # owner_login يقيس Argon2 نفسه: دون كاش التحقق، وإلا أصاب القياس كاش نفس الحسابات التي دخلت أثناء التجهيز والإحماء
+            "VERIFY_CACHE_SECONDS": "0",
+        }
+        env.pop("ASYNC_DATABASE_URL", None)
+        env.pop("DATABASE_REPLICA_URL", None)
+        cmd = [sys.executable, "-m", "benchmarks.bench_api", "--worker", "--size", str(size), "--out", out,
+               "--requests", str(args.requests), "--concurrency", str(args.concurrency), "--seed", str(args.seed),
+               "--stub-latency-ms", str(args.stub_latency_ms), "--scenarios", *args.scenarios]
+        # مجلد العمل المؤقت: الصور المرفوعة لا تلوث مجلد المشروع
+        subprocess.run(cmd, cwd=tmp, env=env, check=True)
+        with open(out, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _compare(old_path: str, new: dict) -> None:
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    old_idx = {(r["size"], name): s for r in old["results"] for name, s in r["scenarios"].items()}
+    print(f"\nvs {old_path} ({old['meta'].get('commit', '?')})")
+    print(f"{'size':>8} {'scenario':<13} {'p50 old':>9} {'p50 new':>9} {'p95 old':>9} {'p95 new':>9} {'rps old':>9} {'rps new':>9}")
+    for r in new["results"]:
+        for name, s in r["scenarios"].items():
+            o = old_idx.get((r["size"], name))
+            if not o: continue
+            print(f"{r['size']:>8} {name:<13} {o['p50_ms']:>9.2f} {s['p50_ms']:>9.2f} {o['p95_ms']:>9.2f} {s['p95_ms']:>9.2f} "
+                  f"{o['throughput_rps']:>9.1f} {s['throughput_rps']:>9.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="عدد الطلبات لكل سيناريو")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="تأخير بديل OpenAI")
+    parser.add_argument("--out", help="مسار ملف النتائج (افتراضياً benchmarks/results/<وقت>-<commit>.json)")
+    parser.add_argument("--compare", help="ملف نتائج سابق للمقارنة")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = asyncio.run(_worker_main(args))
+        with open(args.out, "w", encoding="utf-8") as f: json.dump(result, f)
+        return
+
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "stub_latency_ms": args.stub_latency_ms,
+        },
+        "results": [],
+    }
+    for size in args.sizes:
+        print(f"seeding {size} places ...", file=sys.stderr)
+        report["results"].append(_run_size(size, args))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.utcnow():%Y%m%d-%H%M%S}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'size':>8} {'scenario':<13} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+    for r in report["results"]:
+        for name, s in r["scenarios"].items():
+            print(f"{r['size']:>8} {name:<13} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['throughput_rps']:>9.1f} {s['errors']:>7}")
+    print(f"\nsaved {out}")
+    if args.compare: _compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""مقارنة حساب المسافات: calculate_haversine (المرجع القديم) لكل صف مقابل الحساب المتجه في geo.py.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.bench_distance
+    python -m benchmarks.bench_distance --sizes 1000 10000
+"""
+from __future__ import annotations
+import argparse
+import math
+import time
+
+import numpy as np
+
+from geo import EARTH_RADIUS_KM, GeoIndex, haversine_many, round_km
+
+# مركز رام الله تقريباً
+CENTER = (31.9038, 35.2034)
+
+
+def calculate_haversine(lat1, lon1, lat2, lon2):
+    # المرجع: الدالة القديمة في main.py التي كانت تُستدعى لكل صف (بدون استيراد التطبيق كله)
+    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
+        return None
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lam = math.radians(lat2 - lat1), math.radians(lon2 - lon1)
+    a = (math.sin(d_phi / 2.0) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lam / 2.0) ** 2)
+    return round(EARTH_RADIUS_KM * (2.0 * math.atan2(math.sqrt(a), math.sqrt(1.0 - a))), 2)
+
+
+def _timeit(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(n: int, k: int = 20) -> dict:
+    rng = np.random.default_rng(n)
+    lats = CENTER[0] + rng.uniform(-0.5, 0.5, n)
+    lngs = CENTER[1] + rng.uniform(-0.5, 0.5, n)
+    ids = np.arange(1, n + 1)
+    q_lat, q_lng = CENTER[0] + 0.01, CENTER[1] - 0.01
+
+    # المسار القديم: دالة لكل صف ثم ترتيب القائمة كاملة
+    lat_list, lng_list = lats.tolist(), lngs.tolist()
+    def scalar():
+        d = [calculate_haversine(q_lat, q_lng, a, b) for a, b in zip(lat_list, lng_list)]
+        return sorted(range(n), key=lambda i: d[i])[:k], d
+
+    # المسار المتجه: كل المسافات والترتيب في تمريرة واحدة
+    def vector():
+        d = haversine_many(q_lat, q_lng, lats, lngs)
+        return np.argsort(d, kind="stable")[:k], d
+
+    index = GeoIndex()
+    index.rebuild(zip(ids.tolist(), lat_list, lng_list, [False] * n))
+    def nearest():
+        it = index.iter_nearest(q_lat, q_lng)
+        return [next(it) for _ in range(min(k, n))]
+
+    # التحقق من التطابق بعد التقريب لخانتين
+    ref = scalar()[1]
+    same = ref == round_km(vector()[1])
+
+    repeat = 1 if n >= 1_000_000 else 3
+    return {
+        "n": n,
+        "scalar_ms": _timeit(scalar, repeat) * 1000,
+        "vector_ms": _timeit(vector, repeat) * 1000,
+        "grid_knn_ms": _timeit(nearest, repeat) * 1000,
+        "identical": same,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'places':>10} {'scalar ms':>12} {'vector ms':>12} {'grid k-nn ms':>14} {'speedup':>9}  identical")
+    for n in args.sizes:
+        r = run(n, args.k)
+        print(f"{r['n']:>10} {r['scalar_ms']:>12.2f} {r['vector_ms']:>12.2f} {r['grid_knn_ms']:>14.2f} "
+              f"{r['scalar_ms'] / r['vector_ms']:>8.1f}x  {r['identical']}")
+
+
+if __name__ == "__main__":
+    main()
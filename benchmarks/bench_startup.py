@@ -0,0 +1,179 @@
+"""زمن إقلاع worker: استيراد main (من تقرير python -X importtime) ومراحل lifespan.
+
+كل تشغيل عملية جديدة على نفس قاعدة SQLite مؤقتة: الأول يطبق المخطط (migration)،
+والبقية تمر بفحص البصمة فقط. يُطبع الوسيط لكل مرحلة وأثقل الوحدات المستوردة مباشرة
+من main، وتُحفظ النتائج JSON للمقارنة بين الـ commits (مثل bench_api).
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 10 --top 20
+    python -m benchmarks.bench_startup --compare benchmarks/results/<old>.json
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+# --- داخل العملية الفرعية (تحت -X importtime) ---
+def _worker_main(out: str) -> None:
+    import asyncio
+    t0 = time.perf_counter()
+    import main
+    imported = time.perf_counter() - t0
+
+    async def boot():
+        async with main.app.router.lifespan_context(main.app): pass
+
+    asyncio.run(boot())
+    import metrics
+    # commits أقدم بلا app_startup_seconds: يبقى تقرير importtime وحده
+    startup = getattr(metrics, "STARTUP", None)
+    phases = {labels[0]: seconds for labels, seconds in startup._values.items()} if startup else {}
+    with open(out, "w", encoding="utf-8") as f: json.dump({"import_wall_s": imported, "phases": phases}, f)
+
+
+# --- تحليل تقرير importtime ---
+def _parse_importtime(stderr: str, root: str = "main") -> dict:
+    """يعيد (الزمن التراكمي لـ root، والوحدات المستوردة مباشرة منه) بالميكروثانية."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line: continue
+        self_us, cumulative, name = line.split(":", 1)[1].split("|")
+        # المستوى من المسافات قبل الاسم: مسافة واحدة للمستوى الأعلى ثم اثنتان لكل مستوى
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(self_us), int(cumulative)))
+    for i, (depth, name, _, cumulative) in enumerate(entries):
+        if depth != 0 or name != root: continue
+        # شجرة root هي الأسطر التي تسبقه مباشرة حتى أول سطر بالمستوى الأعلى
+        start = i
+        while start > 0 and entries[start - 1][0] > 0: start -= 1
+        children = {n: c for d, n, _, c in entries[start:i] if d == 1}
+        return {"total_us": cumulative, "children_us": children}
+    return {"total_us": 0, "children_us": {}}
+
+
+def _run_once(db_path: str, workdir: str) -> dict:
+    out = os.path.join(workdir, "result.json")
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+    }
+    env.pop("ASYNC_DATABASE_URL", None)
+    env.pop("DATABASE_REPLICA_URL", None)
+    cmd = [sys.executable, "-X", "importtime", "-m", "benchmarks.bench_startup", "--worker", "--out", out]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True)
+    process_s = time.perf_counter() - t0
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(proc.returncode)
+    with open(out, encoding="utf-8") as f: result = json.load(f)
+    return {**result, "process_s": process_s, "importtime": _parse_importtime(proc.stderr)}
+
+
+def _summary(runs: list, top: int) -> dict:
+    ms = lambda values: round(statistics.median(values) * 1000, 2)
+    # بترتيب حدوثها: import ثم مراحل lifespan
+    phases = list(runs[0]["phases"])
+    modules = {}
+    for r in runs:
+        for name, us in r["importtime"]["children_us"].items(): modules.setdefault(name, []).append(us / 1e6)
+    heaviest = sorted(((ms(v), n) for n, v in modules.items()), reverse=True)[:top]
+    return {
+        "runs": len(runs),
+        "process_ms": ms([r["process_s"] for r in runs]),
+        "import_main_ms": ms([r["importtime"]["total_us"] / 1e6 for r in runs]),
+        "import_wall_ms": ms([r["import_wall_s"] for r in runs]),
+        "phases_ms": {p: ms([r["phases"].get(p, 0.0) for r in runs]) for p in phases},
+        "top_imports_ms": {n: v for v, n in heaviest},
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _print(label: str, s: dict) -> None:
+    print(f"\n{label} ({s['runs']} runs, median)")
+    print(f"  {'process':<24} {s['process_ms']:>9.2f} ms")
+    print(f"  {'import main':<24} {s['import_main_ms']:>9.2f} ms")
+    for phase, v in s["phases_ms"].items():
+        label = "import -> lifespan" if phase == "import" else f"lifespan {phase}"
+        print(f"  {label:<24} {v:>9.2f} ms")
+
+
+def _compare(old_path: str, new: dict) -> None:
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    print(f"\nvs {old_path} ({old['meta'].get('commit', '?')})")
+    print(f"  {'':<24} {'old ms':>9} {'new ms':>9}")
+    for key in ("cold", "warm"):
+        o, n = old.get(key), new.get(key)
+        if not o or not n: continue
+        rows = [("process", o["process_ms"], n["process_ms"]), ("import main", o["import_main_ms"], n["import_main_ms"])]
+        rows += [(f"lifespan {p}", o["phases_ms"].get(p, 0.0), v) for p, v in n["phases_ms"].items() if p != "import"]
+        for name, a, b in rows: print(f"  {key + ' ' + name:<24} {a:>9.2f} {b:>9.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="عدد التشغيلات الدافئة (بعد أول تشغيل يطبق المخطط)")
+    parser.add_argument("--top", type=int, default=15, help="عدد الوحدات الأثقل في التقرير")
+    parser.add_argument("--out", help="مسار ملف النتائج (افتراضياً benchmarks/results/startup-<وقت>-<commit>.json)")
+    parser.add_argument("--compare", help="ملف نتائج سابق للمقارنة")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker_main(args.out)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as tmp:
+        # مجلد عمل مؤقت فيه الواجهة فقط: مجلد الصور الذي ينشئه lifespan لا يلوث المشروع
+        os.symlink(os.path.join(ROOT, "frontend"), os.path.join(tmp, "frontend"))
+        db_path = os.path.join(tmp, "startup.db")
+        print("cold start (empty database) ...", file=sys.stderr)
+        cold = [_run_once(db_path, tmp)]
+        print(f"{args.runs} warm starts ...", file=sys.stderr)
+        warm = [_run_once(db_path, tmp) for _ in range(args.runs)]
+
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "cold": _summary(cold, args.top),
+        "warm": _summary(warm, args.top),
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"startup-{datetime.utcnow():%Y%m%d-%H%M%S}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+
+    _print("cold", report["cold"])
+    _print("warm", report["warm"])
+    print(f"\nheaviest imports under main (warm, cumulative)")
+    for name, v in report["warm"]["top_imports_ms"].items(): print(f"  {name:<24} {v:>9.2f} ms")
+    print(f"\nsaved {out}")
+    if args.compare: _compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+from __future__ import annotations
+import os
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal, ReadSessionLocal, Place
+from catalog import catalog
+import schemas
+import security
+
+# صفوف كل معاملة (commit) في الاستيراد، وصفوف كل دفعة في التصدير
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+# لا نعيد أكثر من هذا العدد من أخطاء الصفوف في الرد
+MAX_REPORTED_ERRORS = 1000
+
+# التصدير لا يتضمن هاش كلمة السر
+EXPORT_FIELDS = (
+    "id", *(f for f in schemas.PlaceCreate.model_fields if f != "owner_password"),
+    "subscription_status", "subscription_start", "subscription_end", "created_at",
+)
+
+
+# --- قراءة الطلب بالتدفق ---
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buf = b""
+    async for chunk in stream:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines: yield line.decode("utf-8-sig").rstrip("\r")
+    if buf.strip(): yield buf.decode("utf-8-sig").rstrip("\r")
+
+async def iter_rows(stream: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """يعيد (رقم الصف، القاموس، خطأ التحليل) صفاً صفاً دون تحميل الملف كاملاً."""
+    n = 0
+    if fmt == "ndjson":
+        async for line in _lines(stream):
+            if not line.strip(): continue
+            n += 1
+            try:
+                row = json.loads(line)
+                yield (n, row, None) if isinstance(row, dict) else (n, None, "السطر ليس كائن JSON")
+            except ValueError as e:
+                yield n, None, f"JSON غير صالح: {e}"
+        return
+    header, record = None, ""
+    async for line in _lines(stream):
+        # حقل بين علامتي تنصيص قد يحتوي أسطراً جديدة: نكمل السجل حتى يتوازن عدد العلامات
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2: continue
+        values, record = next(csv.reader([record]), []), ""
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        if not any(v.strip() for v in values): continue
+        n += 1
+        if len(values) != len(header):
+            yield n, None, f"عدد الأعمدة {len(values)} لا يطابق العناوين ({len(header)})"
+        else:
+            yield n, dict(zip(header, values)), None
+    if record: yield n + 1, None, "علامة تنصيص غير مغلقة في آخر الملف"
+
+
+def _validate(row: dict) -> schemas.PlaceCreate:
+    # خلايا CSV الفارغة تعني "بدون قيمة"
+    return schemas.PlaceCreate.model_validate({k: v for k, v in row.items() if v not in ("", None)})
+
+def _error_text(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors())
+    return str(e)
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def error(self, row: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS: self.errors.append({"row": row, "error": message})
+
+    def as_dict(self) -> dict:
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors,
+                "errors_truncated": self.failed > len(self.errors)}
+
+
+def _insert_batch(batch: List[Tuple[int, schemas.PlaceCreate, str]], activate: bool, report: ImportReport) -> None:
+    db = SessionLocal()
+    try:
+        # البريد فريد: استعلام واحد للدفعة كلها بدل استعلام لكل صف
+        emails = [p.owner_email.lower() for _, p, _ in batch]
+        taken = set(db.scalars(select(Place.owner_email).where(Place.owner_email.in_(emails))))
+        now = datetime.utcnow()
+        rows = []
+        for n, payload, hashed in batch:
+            email = payload.owner_email.lower()
+            if email in taken:
+                report.error(n, "هذا البريد مسجل مسبقاً")
+                continue
+            taken.add(email)
+            place = Place(
+                **payload.model_dump(exclude={"owner_password", "owner_email"}),
+                owner_password=hashed,
+                owner_email=email,
+                subscription_status="active" if activate else "pending",
+                created_at=now,
+            )
+            if activate:
+                place.subscription_start = now
+                place.subscription_end = now + timedelta(days=365)
+            rows.append((n, place))
+        try:
+            db.add_all([p for _, p in rows])
+            db.commit()
+            report.imported += len(rows)
+        except IntegrityError:
+            # تعارض متزامن نادر: نعيد الدفعة صفاً صفاً لمعرفة الصف المخالف
+            db.rollback()
+            for n, place in rows:
+                try:
+                    db.add(place)
+                    db.commit()
+                    report.imported += 1
+                except IntegrityError as e:
+                    db.rollback()
+                    report.error(n, f"خطأ في قاعدة البيانات: {e.orig}")
+    finally:
+        db.close()
+
+
+async def import_places(stream: AsyncIterator[bytes], fmt: str, activate: bool = True) -> dict:
+    report = ImportReport()
+    pending: List[Tuple[int, dict]] = []
+
+    async def flush() -> None:
+        valid = []
+        for n, row in pending:
+            try:
+                valid.append((n, _validate(row)))
+            except Exception as e:
+                report.error(n, _error_text(e))
+        pending.clear()
+        if not valid: return
+        # نفس قص create_place (72) ثم Argon2 بالتوازي في عمليات منفصلة
+        hashes = await security.ahash_many([p.owner_password[:72] for _, p in valid])
+        await run_in_threadpool(_insert_batch, [(n, p, h) for (n, p), h in zip(valid, hashes)], activate, report)
+
+    async for n, row, err in iter_rows(stream, fmt):
+        if err:
+            report.error(n, err)
+            continue
+        pending.append((n, row))
+        if len(pending) >= IMPORT_BATCH_SIZE: await flush()
+    await flush()
+    if report.imported: catalog.invalidate()
+    return report.as_dict()
+
+
+# --- التصدير بالتدفق ---
+def _cell(value) -> str:
+    if value is None: return ""
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def export_places(fmt: str) -> Iterator[bytes]:
+    """مولد متزامن (تشغله Starlette في threadpool)؛ الصفوف تُقرأ على دفعات من cursor على السيرفر."""
+    db = ReadSessionLocal()
+    try:
+        cols = [getattr(Place, f) for f in EXPORT_FIELDS]
+        result = db.execute(select(*cols).order_by(Place.id).execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE))
+        if fmt == "csv":
+            out = io.StringIO()
+            writer = csv.writer(out)
+            # BOM حتى يفتح Excel الملف العربي بترميز صحيح
+            out.write("\ufeff")
+            writer.writerow(EXPORT_FIELDS)
+        for rows in result.partitions():
+            if fmt == "csv":
+                writer.writerows([_cell(v) for v in r] for r in rows)
+                chunk = out.getvalue()
+                out.seek(0)
+                out.truncate()
+            else:
+                chunk = "".join(json.dumps(dict(zip(EXPORT_FIELDS, map(_json_value, r))), ensure_ascii=False) + "\n" for r in rows)
+            yield chunk.encode("utf-8")
+        if fmt == "csv" and out.tell(): yield out.getvalue().encode("utf-8")
+    finally:
+        db.close()
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
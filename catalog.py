@@ -0,0 +1,213 @@
+from __future__ import annotations
+import os
+import gzip
+import hashlib
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session, selectinload
+
+from database import Place, get_catalog_version
+from geo import haversine_many, round_km
+import schemas
+
+# brotli اختياري: إن لم يكن مثبتاً نكتفي بـ gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# قيمة المسافة للأماكن بلا إحداثيات في مفتاح الترتيب
+NO_DISTANCE = 99999
+# يفصل المميز عن غيره في مفتاح واحد (المميز * TIER_STEP + المسافة)؛ أكبر من NO_DISTANCE
+TIER_STEP = 1e6
+# كل كم ثانية نسأل القاعدة عن رقم النسخة (لالتقاط تعديلات الـ workers الأخرى)
+RECHECK_SECONDS = float(os.getenv("CATALOG_RECHECK_SECONDS", "2"))
+# أقصى عدد من الردود المرمزة المحفوظة لكل نسخة (قيم cat/limit/fields مختلفة)
+MAX_ENCODED = int(os.getenv("CATALOG_MAX_ENCODED", "64"))
+MIN_COMPRESS_BYTES = 1024
+
+
+class Encoded:
+    """رد JSON مرمز مسبقاً مع نسخه المضغوطة و ETag قوي لكل تمثيل."""
+
+    __slots__ = ("variants",)
+
+    def __init__(self, body: bytes, version: int):
+        tag = f"v{version}-{hashlib.sha1(body).hexdigest()[:16]}"
+        self.variants = {"identity": (body, f'"{tag}"')}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.variants["gzip"] = (gzip.compress(body, 6, mtime=0), f'"{tag}-gz"')
+            if brotli: self.variants["br"] = (brotli.compress(body), f'"{tag}-br"')
+
+    def pick(self, accept_encoding: Optional[str]) -> Tuple[str, bytes, str]:
+        accepted = {e.split(";")[0].strip() for e in (accept_encoding or "").lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return (encoding, *self.variants[encoding])
+        return ("identity", *self.variants["identity"])
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match: return False
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or any(etag in tags for _, etag in self.variants.values())
+
+
+class Snapshot:
+    """نسخة ثابتة من الكتالوج العام: أماكن فعالة وغير منتهية، جاهزة كـ PlaceOut.
+
+    العناصر مرتبة (المميز ثم الرقم) ومعها مصفوفات NumPy للفلترة والترتيب،
+    ولا تُعدل بعد البناء فيمكن مشاركتها بين الطلبات المتزامنة.
+    """
+
+    def __init__(self, items: List[schemas.PlaceOut], coords: List[Tuple], version: int, valid_until: Optional[datetime]):
+        self.items = items
+        self.version = version
+        self.valid_until = valid_until
+        self.ids = np.array([i.id for i in items], dtype=np.int64)
+        self.not_premium = np.array([not i.is_premium for i in items], dtype=bool)
+        self.categories = np.array([i.category for i in items], dtype=object)
+        coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+        self.lats, self.lngs = coords[:, 0], coords[:, 1]
+        self.cos_lats = np.cos(np.radians(self.lats))
+        self._by_id = np.argsort(self.ids)
+        self._encoded: Dict[tuple, Encoded] = {}
+
+    def encoded(self, key: tuple, build: Callable[[], bytes]) -> Encoded:
+        # يُبنى الرد مرة واحدة لكل (نسخة، مفتاح) ثم تُعاد نفس البايتات
+        enc = self._encoded.get(key)
+        if enc is None:
+            enc = Encoded(build(), self.version)
+            if len(self._encoded) < MAX_ENCODED: self._encoded[key] = enc
+        return enc
+
+    def is_fresh(self, now: datetime) -> bool:
+        # لا TTL: النسخة صالحة حتى أقرب subscription_end فقط
+        return self.valid_until is None or now <= self.valid_until
+
+    def _positions(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        sorted_ids = self.ids[self._by_id]
+        pos = np.clip(np.searchsorted(sorted_ids, ids), 0, max(len(sorted_ids) - 1, 0))
+        found = sorted_ids[pos] == ids if len(sorted_ids) else np.zeros(len(ids), bool)
+        return self._by_id[pos[found]], found
+
+    def select(
+        self,
+        cat: Optional[str] = None,
+        ranks: Optional[Dict[int, float]] = None,
+        lat: Optional[float] = None,
+        lng: Optional[float] = None,
+        radius_km: Optional[float] = None,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[schemas.PlaceOut], int, Dict[int, float]]:
+        """يعيد (عناصر الصفحة، العدد الكلي، صلة البحث لعناصر الصفحة) بنفس ترتيب /api/places."""
+        n = len(self.items)
+        mask = np.ones(n, dtype=bool)
+        if cat: mask &= self.categories == cat
+
+        rank = np.zeros(n)
+        if ranks is not None:
+            rank = np.full(n, np.nan)
+            match_ids = np.fromiter(ranks.keys(), dtype=np.int64, count=len(ranks))
+            pos, found = self._positions(match_ids)
+            rank[pos] = np.fromiter(ranks.values(), dtype=np.float64, count=len(ranks))[found]
+            mask &= ~np.isnan(rank)
+
+        has_geo = lat is not None and lng is not None
+        dist = haversine_many(lat, lng, self.lats, self.lngs, self.cos_lats) if has_geo else np.full(n, np.nan)
+        if has_geo and radius_km is not None:
+            with np.errstate(invalid="ignore"): mask &= dist <= radius_km
+
+        idx = np.nonzero(mask)[0]
+        # نفس مفتاح الترتيب في main._sort_key: المميز، المسافة، الصلة (بدون موقع فقط)، الرقم
+        k_tier = self.not_premium[idx]
+        k_dist = np.nan_to_num(np.round(dist[idx], 2), nan=NO_DISTANCE)
+        k_rank = np.nan_to_num(rank[idx]) if ranks is not None and not has_geo else np.zeros(len(idx))
+        k_id = self.ids[idx]
+        total = len(idx)
+
+        if after:
+            a_tier, a_dist, a_rank, a_id = after
+            later = (k_tier > a_tier) | ((k_tier == a_tier) & (
+                (k_dist > a_dist) | ((k_dist == a_dist) & ((k_rank > a_rank) | ((k_rank == a_rank) & (k_id > a_id))))
+            ))
+            idx, k_tier, k_dist, k_rank, k_id = idx[later], k_tier[later], k_dist[later], k_rank[later], k_id[later]
+
+        # بدون موقع ولا بحث: العناصر مرتبة أصلاً (المميز ثم الرقم) فلا ترتيب
+        if has_geo or ranks is not None:
+            cand = np.arange(len(idx))
+            if limit and len(idx) > limit:
+                # الصفحة فقط: أصغر limit قيمة لـ (المميز، المسافة) بـ argpartition، ثم ترتيب هذه وحدها مع المتعادلين عند الحد
+                primary = k_tier * TIER_STEP + k_dist
+                cand = np.nonzero(primary <= np.partition(primary, limit - 1)[limit - 1])[0]
+            order = cand[np.lexsort((k_id[cand], k_rank[cand], k_dist[cand], k_tier[cand]))]
+            idx, k_rank = idx[order], k_rank[order]
+        if limit:
+            idx, k_rank = idx[:limit], k_rank[:limit]
+
+        # نسخة سطحية لكل عنصر في الصفحة فقط، فالعناصر المشتركة لا تتغير
+        distances = round_km(dist[idx])
+        page = [self.items[i].model_copy(update={"distance": d}) for i, d in zip(idx.tolist(), distances)]
+        return page, total, dict(zip(self.ids[idx].tolist(), k_rank.tolist()))
+
+
+class CatalogCache:
+    def __init__(self):
+        self._snapshot: Optional[Snapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        # تُستدعى بعد كل commit يغير الأماكن أو صورها في هذا الـ worker
+        self._snapshot = None
+
+    def get(self, db: Session) -> Snapshot:
+        now = datetime.utcnow()
+        snap = self._snapshot
+        if snap and snap.is_fresh(now) and time.monotonic() - self._checked_at < RECHECK_SECONDS:
+            return snap
+        version = get_catalog_version(db)
+        self._checked_at = time.monotonic()
+        if snap and snap.version == version and snap.is_fresh(now):
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            if not (snap and snap.version == version and snap.is_fresh(now)):
+                snap = self._snapshot = self._build(db, version, now)
+        return snap
+
+    @staticmethod
+    def _build(db: Session, version: int, now: datetime) -> Snapshot:
+        rows = db.query(Place).options(selectinload(Place.images)).filter(
+            Place.subscription_status == "active",
+            Place.subscription_end >= now,
+        ).order_by(Place.is_premium.desc(), Place.id).all()
+        items, coords = [], []
+        for p in rows:
+            p_out = public_out(p)
+            if p_out is None: continue
+            items.append(p_out)
+            coords.append((p.latitude, p.longitude))
+        valid_until = min((p.subscription_end for p in rows), default=None)
+        return Snapshot(items, coords, version, valid_until)
+
+
+def public_out(p: Place) -> Optional[schemas.PlaceOut]:
+    # مكان فعال كما يراه الزائر (None إن تعذر التحويل)
+    try:
+        p_out = schemas.PlaceOut.model_validate(p)
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+    p_out.subscription_status = "active"
+    p_out.is_expired = False
+    p_out.distance = None
+    return p_out
+
+
+# نسخة واحدة لكل عملية (worker)
+catalog = CatalogCache()
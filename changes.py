@@ -0,0 +1,55 @@
+from __future__ import annotations
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+
+from database import SessionLocal, Place, CatalogState, Tombstone, get_catalog_version
+from catalog import catalog, public_out
+
+# شواهد الحذف الأقدم من هذا تُحذف؛ العميل الذي لم يزامن خلالها يأخذ نسخة كاملة (reset)
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+
+
+def place_changes(db: Session, since: int) -> dict:
+    """ما تغير في الكتالوج العام بعد رقم النسخة since (0 = نسخة كاملة)."""
+    revision = get_catalog_version(db)
+    floor = db.query(CatalogState.tombstones_before).filter(CatalogState.id == 1).scalar() or 0
+    # رقم أكبر من الحالي يعني قاعدة أخرى (استعادة نسخة احتياطية مثلاً)
+    reset = since > 0 and (since < floor or since > revision)
+    if since <= 0 or reset:
+        snap = catalog.get(db)
+        return {"revision": snap.version, "reset": reset, "changed": snap.items}
+
+    # رقم النسخة يُقرأ أولاً: ما يُكتب بعده قد يتكرر في الطلب التالي لكنه لا يضيع
+    now = datetime.utcnow()
+    changed, deleted = [], set()
+    rows = db.query(Place).options(selectinload(Place.images)).filter(Place.revision > since).order_by(Place.id)
+    for p in rows:
+        visible = p.subscription_status == "active" and p.subscription_end is not None and p.subscription_end >= now
+        p_out = public_out(p) if visible else None
+        if p_out is None: deleted.add(p.id)
+        else: changed.append(p_out)
+
+    deleted_images = []
+    for kind, object_id in db.query(Tombstone.kind, Tombstone.object_id).filter(Tombstone.revision > since):
+        if kind == "place": deleted.add(object_id)
+        else: deleted_images.append(object_id)
+    return {"revision": revision, "changed": changed, "deleted": sorted(deleted), "deleted_images": sorted(deleted_images)}
+
+
+def prune_tombstones() -> int:
+    """يحذف شواهد الحذف القديمة ويسجل أعلى رقم محذوف في catalog_state.tombstones_before."""
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        upto = db.query(func.max(Tombstone.revision)).filter(Tombstone.deleted_at < cutoff).scalar()
+        if upto is None: return 0
+        removed = db.query(Tombstone).filter(Tombstone.revision <= upto).delete(synchronize_session=False)
+        # upto لا يتناقص بين تمريرة وأخرى (الشواهد الأحدث أرقامها أكبر)
+        db.query(CatalogState).filter(CatalogState.id == 1).update({CatalogState.tombstones_before: upto}, synchronize_session=False)
+        db.commit()
+        return removed
+    finally:
+        db.close()
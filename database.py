@@ -1,11 +1,14 @@
 from __future__ import annotations
 import os
+import json
+import hashlib
 from datetime import datetime
 from sqlalchemy import (
     create_engine, Column, Integer, String, 
-    Text, Boolean, DateTime, Float, ForeignKey
+    Text, Boolean, DateTime, Float, ForeignKey, Index, event, update, select, inspect, text
 )
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 # إعدادات المسارات والقاعدة
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -19,12 +22,78 @@ DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
-)
+# --- إعدادات الاتصال (قابلة للتعديل من متغيرات البيئة) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# كاش الجمل المترجمة في SQLAlchemy، وكاش الجمل المحضرة في asyncpg
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+PG_PREPARED_CACHE_SIZE = int(os.getenv("PG_PREPARED_CACHE_SIZE", "100"))
+
+# SQLite: وضع WAL يسمح للقراء بالعمل أثناء الكتابة، و busy_timeout بدل خطأ "database is locked" الفوري
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs = {"pool_pre_ping": DB_POOL_PRE_PING, "query_cache_size": DB_STATEMENT_CACHE_SIZE}
+    if url.startswith("sqlite"):
+        if "aiosqlite" not in url: kwargs["connect_args"] = {"check_same_thread": False}
+        # القاعدة في الذاكرة تستخدم اتصالاً واحداً بلا pool
+        if ":memory:" in url or url.rstrip("/").endswith("sqlite:") or url.rstrip("/").endswith("aiosqlite:"):
+            return kwargs
+    elif "asyncpg" in url:
+        kwargs["connect_args"] = {"prepared_statement_cache_size": PG_PREPARED_CACHE_SIZE}
+    kwargs.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return kwargs
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record) -> None:
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.close()
+
+def _make_engine(url: str):
+    eng = create_engine(url, **_engine_kwargs(url))
+    if url.startswith("sqlite"): event.listen(eng, "connect", _set_sqlite_pragmas)
+    return eng
+
+engine = _make_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# نسخة للقراءة فقط (اختيارية) لمسارات GET؛ بدونها نقرأ من القاعدة الرئيسية
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+if DATABASE_REPLICA_URL and DATABASE_REPLICA_URL.startswith("postgres://"):
+    DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+read_engine = _make_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# --- المحرك غير المتزامن (aiosqlite محلياً / asyncpg على Render) لمسارات async ---
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        # asyncpg لا يفهم sslmode بل ssl
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1).replace("sslmode=", "ssl=")
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(ASYNC_DATABASE_URL))
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 class Place(Base):
@@ -65,9 +134,15 @@ class Place(Base):
     is_premium = Column(Boolean, default=False, nullable=False)
     is_verified = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # رقم نسخة الكتالوج عند آخر تعديل على المكان أو صوره (لـ /api/places/changes)
+    updated_at = Column(DateTime, nullable=True)
+    revision = Column(Integer, nullable=True, index=True)
 
     images = relationship("PlaceImage", back_populates="place", cascade="all, delete-orphan", lazy="selectin")
 
+    # القائمة العامة تفلتر بـ subscription_status = 'active' (الماسح يحول المنتهي إلى 'expired')
+    __table_args__ = (Index("ix_places_status_category_premium", "subscription_status", "category", "is_premium"),)
+
 class PlaceImage(Base):
     __tablename__ = "place_images"
     id = Column(Integer, primary_key=True, index=True)
@@ -76,7 +151,161 @@ class PlaceImage(Base):
     caption = Column(String(255), nullable=True)
     sort_order = Column(Integer, default=0, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # أبعاد الأصل والنسخ المصغرة (WebP) بعد المعالجة: JSON [[العرض, الرابط], ...] من الأصغر للأكبر
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    variants = Column(Text, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    revision = Column(Integer, nullable=True)
     place = relationship("Place", back_populates="images")
 
-def init_db() -> None:
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    def variant_list(self) -> list:
+        try:
+            return json.loads(self.variants) if self.variants else []
+        except ValueError:
+            return []
+
+    @property
+    def thumb_url(self):
+        v = self.variant_list()
+        return v[0][1] if v else None
+
+    @property
+    def srcset(self):
+        v = self.variant_list()
+        return ", ".join(f"{url} {w}w" for w, url in v) if v else None
+
+# رقم نسخة الكتالوج: يزداد مع كل تعديل على الأماكن أو صورها (مشترك بين كل الـ workers)
+class CatalogState(Base):
+    __tablename__ = "catalog_state"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+    # شواهد الحذف حتى هذا الرقم حُذفت: العميل الأقدم منه يحتاج مزامنة كاملة
+    tombstones_before = Column(Integer, nullable=True)
+
+# شاهد حذف (tombstone) لكل مكان أو صورة محذوفة، حتى تعرف نسخ العملاء ما تحذفه
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(10), nullable=False) # place / image
+    object_id = Column(Integer, nullable=False)
+    place_id = Column(Integer, nullable=True)
+    revision = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+def subscription_state(place) -> str:
+    # الحالة المخزنة المتوقعة حسب تاريخ الانتهاء (pending تبقى كما هي)
+    if place.subscription_status == "pending": return "pending"
+    if not place.subscription_end or place.subscription_end < datetime.utcnow(): return "expired"
+    return "active"
+
+@event.listens_for(Session, "before_flush")
+def _sync_subscription_status(session, flush_context, instances) -> None:
+    # أي تعديل على مكان (تمديد، تفعيل، إنشاء) يبقي العمود متوافقاً مع subscription_end
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Place) and obj.subscription_status in ("active", "expired"):
+            state = subscription_state(obj)
+            if obj.subscription_status != state: obj.subscription_status = state
+
+def bump_catalog_version(session) -> int:
+    # نفس المعاملة (transaction) الخاصة بالتعديل، فالرقم لا يتغير إلا إذا نجح الـ commit
+    # (قفل الصف حتى الـ commit يجعل الأرقام تظهر للقراء بترتيبها)
+    res = session.execute(update(CatalogState).where(CatalogState.id == 1).values(version=CatalogState.version + 1))
+    if res.rowcount == 0:
+        session.execute(CatalogState.__table__.insert().values(id=1, version=1))
+        return 1
+    return session.execute(select(CatalogState.version).where(CatalogState.id == 1)).scalar()
+
+@event.listens_for(Session, "before_flush")
+def _bump_catalog_version(session, flush_context, instances) -> None:
+    changed = [o for o in (*session.new, *(o for o in session.dirty if session.is_modified(o))) if isinstance(o, (Place, PlaceImage))]
+    deleted = [o for o in session.deleted if isinstance(o, (Place, PlaceImage))]
+    if not changed and not deleted: return
+    revision = bump_catalog_version(session)
+    now = datetime.utcnow()
+    deleted_places = {o.id for o in deleted if isinstance(o, Place)}
+    stamped = {o.id for o in changed if isinstance(o, Place)}
+    parents = set()
+    for obj in changed:
+        obj.revision, obj.updated_at = revision, now
+        if isinstance(obj, PlaceImage): parents.add(obj.place_id)
+    for obj in deleted:
+        # صور المكان المحذوف تُحذف معه عند العميل، فلا شاهد لها
+        if isinstance(obj, PlaceImage) and obj.place_id in deleted_places: continue
+        kind = "place" if isinstance(obj, Place) else "image"
+        session.add(Tombstone(kind=kind, object_id=obj.id, place_id=obj.place_id if kind == "image" else obj.id, revision=revision, deleted_at=now))
+        if kind == "image": parents.add(obj.place_id)
+    # تعديل الصور يغير المكان نفسه في الـ feed (يُرسل المكان كاملاً بصوره)
+    parents -= deleted_places | stamped | {None}
+    if parents:
+        session.execute(
+            update(Place).where(Place.id.in_(parents)).values(revision=revision, updated_at=now),
+            execution_options={"synchronize_session": False},
+        )
+
+# بصمة المخطط المطبق على القاعدة: إن طابقت النماذج الحالية يتخطى الإقلاع create_all وفحص الأعمدة
+class SchemaState(Base):
+    __tablename__ = "schema_state"
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# نتائج /api/ai-scan السابقة حسب بصمة محتوى الصورة (كاش دائم مشترك بين الـ workers)
+class AIScanCache(Base):
+    __tablename__ = "ai_scan_cache"
+    key = Column(String(64), primary_key=True)
+    result = Column(Text, nullable=False)
+    size = Column(Integer, nullable=False)
+    hits = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_used = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+def get_catalog_version(db) -> int:
+    return db.query(CatalogState.version).filter(CatalogState.id == 1).scalar() or 0
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def _add_missing_columns(conn) -> None:
+    # create_all لا يعدل الجداول الموجودة: نضيف الأعمدة الجديدة (القابلة لـ NULL) والفهارس للقواعد القديمة
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name): continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing or not col.nullable: continue
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(conn.dialect)}'))
+        for index in table.indexes: index.create(conn, checkfirst=True)
+
+def schema_fingerprint() -> str:
+    # الجداول والأعمدة والفهارس كما تعرفها النماذج؛ أي تعديل عليها يغير البصمة
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(table.name)
+        parts += [f"{c.name}:{c.type}:{c.nullable}" for c in table.columns]
+        parts += sorted(i.name for i in table.indexes)
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+def _schema_is_current(fingerprint: str) -> bool:
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(SchemaState.fingerprint).where(SchemaState.id == 1)).scalar() == fingerprint
+    except Exception:
+        # قاعدة جديدة أو قديمة بلا جدول schema_state
+        return False
+
+def init_db(force: bool = False) -> None:
+    fingerprint = schema_fingerprint()
+    if not force and _schema_is_current(fingerprint): return
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _add_missing_columns(conn)
+        conn.execute(SchemaState.__table__.delete())
+        conn.execute(SchemaState.__table__.insert().values(id=1, fingerprint=fingerprint, applied_at=datetime.utcnow()))
+    print("--- [OK] Database schema migrated ---")
+
+
+# خطوة ترحيل لمرة واحدة قبل تشغيل الـ workers (مثلاً أمر release/build): python database.py
+if __name__ == "__main__":
+    init_db(force=True)
\ No newline at end of file
@@ -0,0 +1,49 @@
+from __future__ import annotations
+import os
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import or_
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal, Place, bump_catalog_version
+from catalog import catalog
+from changes import prune_tombstones
+
+# كل كم ثانية نحول الاشتراكات المنتهية إلى "expired"
+EXPIRY_SWEEP_SECONDS = float(os.getenv("EXPIRY_SWEEP_SECONDS", "300"))
+
+
+def sweep_expired() -> int:
+    """يحول الأماكن الفعالة التي انتهى اشتراكها إلى expired؛ يعيد عدد الصفوف المتغيرة."""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        ids = [pid for (pid,) in db.query(Place.id).filter(
+            Place.subscription_status == "active",
+            or_(Place.subscription_end.is_(None), Place.subscription_end < now),
+        )]
+        if ids:
+            # التحديث الجماعي لا يمر بـ before_flush، فنرفع رقم نسخة الكتالوج ونختم الصفوف يدوياً
+            revision = bump_catalog_version(db)
+            db.query(Place).filter(Place.id.in_(ids), Place.subscription_status == "active").update(
+                {Place.subscription_status: "expired", Place.revision: revision, Place.updated_at: now},
+                synchronize_session=False,
+            )
+            db.commit()
+    finally:
+        db.close()
+    if ids: catalog.invalidate()
+    return len(ids)
+
+
+async def run_sweeper() -> None:
+    # يعمل في كل worker (التحديث نفسه idempotent)، والاستعلام في threadpool
+    while True:
+        try:
+            changed = await run_in_threadpool(sweep_expired)
+            if changed: print(f"--- [OK] Expired {changed} subscriptions ---")
+            await run_in_threadpool(prune_tombstones)
+        except Exception as e:
+            print(f"--- [Error] Expiry sweep: {e} ---")
+        await asyncio.sleep(EXPIRY_SWEEP_SECONDS)
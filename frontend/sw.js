@@ -1,11 +1,11 @@
-﻿const CACHE_NAME = "ramallah-time-v4"; // تم تغيير النسخة لفرض التحديث
+﻿// يستبدل السيرفر هذا السطر عند الإقلاع (assets.py): نسخة الملفات وروابطها ذات البصمة
+const ASSET_MANIFEST = {"version": "dev", "urls": ["/", "/static/style.css", "/static/ramallah.js"]};
+const CACHE_NAME = `ramallah-time-${ASSET_MANIFEST.version}`;
 
 // الملفات التي يتم تخزينها ليعمل الموقع بسرعة (الملفات الثابتة فقط)
-const PRECACHE_URLS = [
-  "/",
-  "/static/style.css",
-  "/static/ramallah.js"
-];
+const PRECACHE_URLS = ASSET_MANIFEST.urls;
+// الملفات ذات البصمة (style.<hash>.css) لا يتغير محتواها، فالكاش أولاً دائماً
+const FINGERPRINTED = /^\/static\/.+\.[0-9a-f]{10}\.(css|js)$/;
 
 self.addEventListener("install", (event) => {
   event.waitUntil(
@@ -35,11 +35,17 @@ self.addEventListener("fetch", (event) => {
     return; // اترك الطلب يذهب للسيرفر مباشرة دون تدخل من السيرفس وركر
   }
 
-  // استراتيجية الملفات الثابتة: الكاش أولاً للسرعة
-  if (PRECACHE_URLS.includes(url.pathname) || url.pathname.startsWith("/static/")) {
+  // استراتيجية الملفات ذات البصمة: الكاش أولاً للسرعة (الاسم يتغير مع المحتوى)
+  if (FINGERPRINTED.test(url.pathname)) {
     event.respondWith(
       caches.match(event.request).then((cached) => {
-        return cached || fetch(event.request);
+        return cached || fetch(event.request).then((res) => {
+          if (res.ok) {
+            const copy = res.clone();
+            caches.open(CACHE_NAME).then((cache) => cache.put(event.request, copy));
+          }
+          return res;
+        });
       })
     );
     return;
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import math
+import time
+import threading
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database import Place, get_catalog_version
+import metrics
+
+# --- ثوابت جغرافية ---
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = EARTH_RADIUS_KM * math.pi / 180.0
+# حجم خلية الشبكة بالدرجات (~2.2 كم عرضياً) مناسب لكثافة أماكن المدينة
+CELL_DEG = 0.02
+
+
+def haversine_many(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray, cos_lats: Optional[np.ndarray] = None) -> np.ndarray:
+    # النسخة المتجهة (NumPy) من نفس المعادلة وبنفس ترتيب العمليات،
+    # لذلك تطابق الحساب القديم لكل صف بعد التقريب لخانتين (المرجع في benchmarks/bench_distance.py)
+    t0 = time.perf_counter()
+    if cos_lats is None: cos_lats = np.cos(np.radians(lats))
+    a = np.sin(np.radians(lats - lat) / 2.0) ** 2 + math.cos(math.radians(lat)) * cos_lats * np.sin(np.radians(lngs - lng) / 2.0) ** 2
+    d = EARTH_RADIUS_KM * (2.0 * np.arctan2(np.sqrt(a), np.sqrt(1.0 - a)))
+    metrics.record("geo", time.perf_counter() - t0)
+    return d
+
+
+def round_km(d: np.ndarray) -> list:
+    # التقريب لخانتين كما في الحساب القديم لكل صف (NaN تعني بلا مسافة)
+    return [None if x != x else x for x in np.round(d, 2).tolist()]
+
+
+def _cell_of(lat: float, lng: float, cell_deg: float) -> Tuple[int, int]:
+    return (math.floor(lat / cell_deg), math.floor(lng / cell_deg))
+
+
+class GeoIndex:
+    """فهرس شبكي في الذاكرة لإحداثيات الأماكن.
+
+    الإحداثيات محفوظة في مصفوفات NumPy متصلة، ويُعاد بناؤها فقط عندما يتغير
+    رقم نسخة الكتالوج في القاعدة (إضافة/تعديل/حذف). الخلايا تشير لمواقع داخل
+    هذه المصفوفات، فتُحسب مسافات كل حلقة دفعة واحدة مع تقليم الخلايا البعيدة.
+    """
+
+    def __init__(self, cell_deg: float = CELL_DEG):
+        self.cell_deg = cell_deg
+        self.version: Optional[int] = None
+        self._lock = threading.Lock()
+        self._state = self._build([])
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    def _build(self, rows: list) -> tuple:
+        # المصفوفات مرتبة حسب رقم المكان: نفس الترتيب داخل كل خلية مهما كان ترتيب الصفوف
+        rows = sorted((r for r in rows if r[1] is not None and r[2] is not None), key=lambda r: r[0])
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        lats = np.array([r[1] for r in rows], dtype=np.float64)
+        lngs = np.array([r[2] for r in rows], dtype=np.float64)
+        premium = np.array([bool(r[3]) for r in rows], dtype=bool)
+
+        cells: dict = {}
+        bounds = None
+        if len(ids):
+            ci = np.floor(lats / self.cell_deg).astype(np.int64)
+            cj = np.floor(lngs / self.cell_deg).astype(np.int64)
+            keys, inverse = np.unique(np.stack([ci, cj], axis=1), axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+            order = np.argsort(inverse, kind="stable")
+            splits = np.cumsum(np.bincount(inverse, minlength=len(keys)))[:-1]
+            for (i, j), pos in zip(keys.tolist(), np.split(order, splits)):
+                cells[(i, j)] = pos
+            bounds = (int(ci.min()), int(ci.max()), int(cj.min()), int(cj.max()))
+        return ids, lats, lngs, np.cos(np.radians(lats)), premium, cells, bounds
+
+    def rebuild(self, rows: Iterable[Tuple[int, float, float, bool]], version: Optional[int] = None) -> None:
+        # تبديل البنية الجديدة دفعة واحدة حتى لا يرى الطلب المتزامن فهرساً نصف جاهز
+        self._state = self._build(list(rows))
+        self.version = version
+
+    def ensure(self, db: Session) -> "GeoIndex":
+        version = get_catalog_version(db)
+        if version == self.version: return self
+        with self._lock:
+            if version != self.version:
+                rows = db.query(Place.id, Place.latitude, Place.longitude, Place.is_premium).filter(
+                    Place.latitude.isnot(None), Place.longitude.isnot(None)
+                ).all()
+                self.rebuild(rows, version)
+        return self
+
+    @staticmethod
+    def _ring(ci: int, cj: int, r: int, bounds: Tuple[int, int, int, int]) -> Iterator[Tuple[int, int]]:
+        # خلايا الحلقة r حول (ci, cj) مقصوصة على حدود الخلايا المعروفة فقط
+        i0, i1, j0, j1 = bounds
+        for i in ((ci - r, ci + r) if r else (ci,)):
+            if i0 <= i <= i1:
+                for j in range(max(cj - r, j0), min(cj + r, j1) + 1): yield (i, j)
+        for j in ((cj - r, cj + r) if r else ()):
+            if j0 <= j <= j1:
+                for i in range(max(ci - r + 1, i0), min(ci + r - 1, i1) + 1): yield (i, j)
+
+    def _ring_lower_bound(self, lat: float, lng: float, ci: int, cj: int, r: int) -> float:
+        # أقل مسافة ممكنة لأي نقطة خارج المربع المفحوص حتى الحلقة r
+        c = self.cell_deg
+        d_lat = min(lat - (ci - r) * c, (ci + r + 1) * c - lat)
+        d_lng = min(lng - (cj - r) * c, (cj + r + 1) * c - lng)
+        max_abs_lat = min(90.0, max(abs((ci - r) * c), abs((ci + r + 1) * c)))
+        # معامل أمان صغير لأن قوس الدائرة العظمى أقصر قليلاً من خط العرض
+        km_lng = KM_PER_DEG_LAT * math.cos(math.radians(max_abs_lat)) * 0.99
+        return max(0.0, min(d_lat * KM_PER_DEG_LAT, d_lng * km_lng))
+
+    def iter_nearest(
+        self, lat: float, lng: float,
+        radius_km: Optional[float] = None,
+        premium: Optional[bool] = None,
+    ) -> Iterator[Tuple[float, int]]:
+        """يعيد (المسافة بالكم بدون تقريب، رقم المكان) من الأقرب للأبعد.
+
+        الترتيب بالمسافة المقربة لخانتين ثم برقم المكان، مثل ترتيب القائمة الكاملة.
+        """
+        ids, lats, lngs, cos_lats, prem, cells, bounds = self._state
+        if not bounds: return
+        ci, cj = _cell_of(lat, lng, self.cell_deg)
+        # أبعد حلقة نحتاجها لتغطية كل الخلايا المعروفة
+        max_r = max(abs(ci - bounds[0]), abs(ci - bounds[1]), abs(cj - bounds[2]), abs(cj - bounds[3]))
+        pend_d, pend_pos = np.empty(0), np.empty(0, np.int64)
+        # لا داعي لفحص الحلقات الفارغة قبل الوصول لحدود الفهرس
+        r = max(0, bounds[0] - ci, ci - bounds[1], bounds[2] - cj, cj - bounds[3])
+        while r <= max_r:
+            ring = [cells[k] for k in self._ring(ci, cj, r, bounds) if k in cells]
+            if ring:
+                pos = np.concatenate(ring)
+                if premium is not None: pos = pos[prem[pos] == premium]
+                d = haversine_many(lat, lng, lats[pos], lngs[pos], cos_lats[pos])
+                if radius_km is not None:
+                    keep = d <= radius_km
+                    pos, d = pos[keep], d[keep]
+                pend_d, pend_pos = np.concatenate([pend_d, d]), np.concatenate([pend_pos, pos])
+            bound = self._ring_lower_bound(lat, lng, ci, cj, r)
+            # الترتيب بالمسافة المقربة لخانتين ثم رقم المكان (نفس مفتاح ترتيب /api/places)،
+            # لذلك لا نُخرج إلا ما مسافته المقربة أقل من مسافة أي نقطة لم تُفحص بعد
+            ready = np.round(pend_d, 2) < round(bound, 2)
+            if ready.any():
+                yield from self._sorted(pend_d[ready], ids[pend_pos[ready]])
+                pend_d, pend_pos = pend_d[~ready], pend_pos[~ready]
+            if radius_km is not None and bound > radius_km: break
+            r += 1
+        if len(pend_d):
+            yield from self._sorted(pend_d, ids[pend_pos])
+
+    @staticmethod
+    def _sorted(d: np.ndarray, ids: np.ndarray) -> Iterator[Tuple[float, int]]:
+        order = np.lexsort((ids, np.round(d, 2)))
+        return zip(d[order].tolist(), ids[order].tolist())
+
+
+# نسخة واحدة لكل عملية (worker)
+place_index = GeoIndex()
@@ -1,10 +1,13 @@
+import time
+# بداية الإقلاع: وقت الاستيراد حتى lifespan يُسجل في app_startup_seconds
+_BOOT_STARTED = time.perf_counter()
 import os
 from dotenv import load_dotenv
 load_dotenv()
-import uuid
+import asyncio
 import base64
 import json
-import math
+import numpy as np
 from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
 from typing import Optional, List
@@ -12,50 +15,96 @@ from pydantic import BaseModel
 
 from fastapi import (
     FastAPI, Depends, HTTPException, Query, 
-    UploadFile, File, Form, Header
+    UploadFile, File, Form, Header, BackgroundTasks, Request
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_
-from passlib.context import CryptContext
-from openai import OpenAI
+from sqlalchemy.orm import Session, selectinload, load_only, noload
+from sqlalchemy import or_, and_, func, select, literal
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import SessionLocal, init_db, Place, PlaceImage
+from database import SessionLocal, ReadSessionLocal, engine, init_db, get_async_db, Place, PlaceImage
+from geo import place_index, haversine_many, round_km
+from catalog import catalog, NO_DISTANCE
 import schemas
+import search
+import security
+import media
+import expiry
+import metrics
+import bulk
+import changes
+from assets import asset_store, AssetFiles, IMMUTABLE
+from ratelimit import limiter
+from retrieval import guide_index, build_context
+from scan_cache import scan_cache, content_key
 
 # --- الإعدادات والمفاتيح ---
 ADMIN_SECRET_KEY = os.environ.get("ADMIN_SECRET_KEY", "ADMIN123123123")
 api_key = os.environ.get("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key) if api_key else None
-
-# نظام التشفير (إصلاح: Argon2 يحتاج Text في القاعدة)
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
-# --- الحسابات الجغرافية ---
-def calculate_haversine(lat1, lon1, lat2, lon2):
-    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
-        return None
+# عميل غير متزامن: استدعاء النموذج لا يجمد الـ event loop ولا يوقف بقية الطلبات
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "30"))
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "4"))
+OPENAI_QUEUE_TIMEOUT = float(os.environ.get("OPENAI_QUEUE_TIMEOUT", "10"))
+# يُنشأ عند أول استخدام: استيراد مكتبة openai وحده أبطأ جزء في إقلاع الـ worker
+client = None
+_ai_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+def ai_client():
+    global client
+    if client is None and api_key:
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=api_key, timeout=OPENAI_TIMEOUT, max_retries=1)
+    return client
+
+async def ai_chat(**kwargs):
+    # حد أقصى للطلبات المتزامنة للنموذج في كل worker، والباقي ينتظر دوره لفترة محدودة
+    t0 = time.perf_counter()
+    try:
+        await asyncio.wait_for(_ai_slots.acquire(), timeout=OPENAI_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="المساعد الذكي مشغول حالياً، حاول بعد قليل")
+    finally:
+        metrics.OPENAI_QUEUE.observe(time.perf_counter() - t0)
+    t0, outcome = time.perf_counter(), "error"
     try:
-        R = 6371.0
-        phi1, phi2 = math.radians(lat1), math.radians(lat2)
-        d_phi, d_lam = math.radians(lat2 - lat1), math.radians(lon2 - lon1)
-        a = (math.sin(d_phi / 2.0) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lam / 2.0) ** 2)
-        return round(R * (2.0 * math.atan2(math.sqrt(a), math.sqrt(1.0 - a))), 2)
-    except: return None
+        res = await ai_client().chat.completions.create(**kwargs)
+        outcome = "ok"
+        return res
+    finally:
+        _ai_slots.release()
+        elapsed = time.perf_counter() - t0
+        metrics.OPENAI_LATENCY.observe(elapsed, kwargs.get("model", ""), outcome)
+        metrics.record("openai", elapsed)
 
 # --- دورة حياة التطبيق ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # تشغيل تهيئة القاعدة مرة واحدة فقط عند الإقلاع
+    metrics.STARTUP.set(time.perf_counter() - _BOOT_STARTED, "import")
+    os.makedirs(PLACE_IMAGES_DIR, exist_ok=True)
+    # المخطط يُنشأ فقط إن تغير (فحص بصمة باستعلام واحد)، أو مسبقاً بـ python database.py
     try:
-        init_db()
+        with metrics.startup_phase("db_init"):
+            init_db()
         print("--- [OK] Database Initialized ---")
     except Exception as e:
         print(f"--- [Error] DB Init: {e} ---")
+    # مستقلة عن init_db: فشل الترحيل في worker (سباق ALTER TABLE مثلاً) لا يوقف فهرس البحث فيه
+    try:
+        with metrics.startup_phase("search_init"):
+            search.init_search(engine)
+    except Exception as e:
+        print(f"--- [Error] Search Init: {e} ---")
+    # بصمات ملفات الواجهة وضغطها مسبقاً (مرة واحدة لكل عملية)
+    with metrics.startup_phase("assets"):
+        asset_store.build()
+    # الماسح الدوري للاشتراكات المنتهية (أول تمريرة فور الإقلاع)
+    sweeper = asyncio.create_task(expiry.run_sweeper())
     yield
+    sweeper.cancel()
+    security.shutdown_pool()
 
 app = FastAPI(title="Ramallah Time API", version="4.0.0", lifespan=lifespan)
 
@@ -66,47 +115,54 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# آخر middleware يُضاف هو الخارجي: القياس يشمل CORS وكل ما بعده
+app.add_middleware(metrics.MetricsMiddleware)
 
 # إدارة المجلدات
-IMAGES_DIR = "images"
-PLACE_IMAGES_DIR = os.path.join(IMAGES_DIR, "places")
-os.makedirs(PLACE_IMAGES_DIR, exist_ok=True)
+IMAGES_DIR = media.IMAGES_DIR
+PLACE_IMAGES_DIR = media.PLACE_IMAGES_DIR
 
-# ربط الملفات الثابتة
-app.mount("/images", StaticFiles(directory=IMAGES_DIR), name="images")
+# ربط الملفات الثابتة (مجلد الصور يُنشأ في lifespan)
+# الصور المرفوعة أسماؤها uuid ولا يُعاد الكتابة فوقها، فيمكن تخزينها في المتصفح بلا مراجعة
+app.mount("/images", AssetFiles(directory=IMAGES_DIR, cache_control=IMMUTABLE, check_dir=False), name="images")
 if os.path.exists("frontend"):
-    app.mount("/static", StaticFiles(directory="frontend"), name="static")
+    app.mount("/static", AssetFiles(directory="frontend", store=asset_store), name="static")
 
 def get_db():
     db = SessionLocal()
     try: yield db
     finally: db.close()
 
+# لمسارات GET: تقرأ من النسخة المتماثلة إن وُجدت (DATABASE_REPLICA_URL)
+def get_read_db():
+    db = ReadSessionLocal()
+    try: yield db
+    finally: db.close()
+
 # --- توجيه الصفحات ---
 @app.get("/")
-def home(user_agent: Optional[str] = Header(None)):
+def home(request: Request, user_agent: Optional[str] = Header(None)):
     ua = user_agent.lower() if user_agent else ""
     is_mobile = any(x in ua for x in ["iphone", "android", "mobile"])
-    path = "frontend/mobile.html" if is_mobile else "frontend/index.html"
-    return FileResponse(path)
+    return asset_store.page("mobile.html" if is_mobile else "index.html", request.headers)
 
 @app.get("/places")
-def places_page(): return FileResponse("frontend/places.html")
+def places_page(request: Request): return asset_store.page("places.html", request.headers)
 
 @app.get("/add-place")
-def add_place_page(): return FileResponse("frontend/add-place.html")
+def add_place_page(request: Request): return asset_store.page("add-place.html", request.headers)
 
 @app.get("/owner-login")
-def owner_login_page(): return FileResponse("frontend/owner-login.html")
+def owner_login_page(request: Request): return asset_store.page("owner-login.html", request.headers)
 
 @app.get("/owner-dashboard")
-def owner_dashboard_page(): return FileResponse("frontend/owner-dashboard.html")
+def owner_dashboard_page(request: Request): return asset_store.page("owner-dashboard.html", request.headers)
 
 @app.get("/manifest.json")
 def get_manifest(): return FileResponse("frontend/manifest.json")
 
 @app.get("/sw.js")
-def get_sw(): return FileResponse("frontend/sw.js")
+def get_sw(request: Request): return asset_store.service_worker(request.headers)
 
 @app.get("/favicon.ico")
 def get_favicon(): return {"status": "no-icon"}
@@ -122,21 +178,32 @@ def get_place_status(place: Place) -> str:
     return "expired" if is_expired(place) else "active"
 
 # --- [ميزة] الماسح الذكي بالذكاء الاصطناعي ---
-@app.post("/api/ai-scan")
+AI_SCAN_MODEL = "gpt-4o"
+AI_SCAN_PROMPT = "Extract business info (name, category, phone, area, description) in JSON format."
+
+@app.post("/api/ai-scan", dependencies=[Depends(limiter.limit("ai"))])
 async def scan_place_with_ai(image: UploadFile = File(...)):
-    if not client: raise HTTPException(status_code=503, detail="OpenAI Key Missing")
-    image_data = await image.read()
-    base64_image = base64.b64encode(image_data).decode("utf-8")
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+    if not ai_client(): raise HTTPException(status_code=503, detail="OpenAI Key Missing")
+    image_data, ext = await media.read_upload(image)
+    # نفس الصورة (إعادة المحاولة بعد رد بطيء) تعيد النتيجة المحفوظة دون استدعاء OpenAI
+    key = content_key(image_data, AI_SCAN_MODEL, AI_SCAN_PROMPT)
+
+    async def extract() -> dict:
+        data, mime = await run_in_threadpool(media.downscale_for_ai, image_data, ext)
+        base64_image = base64.b64encode(data).decode("utf-8")
+        response = await ai_chat(
+            model=AI_SCAN_MODEL,
             messages=[
-                {"role": "system", "content": "Extract business info (name, category, phone, area, description) in JSON format."},
-                {"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}]}
+                {"role": "system", "content": AI_SCAN_PROMPT},
+                {"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"data:{mime};base64,{base64_image}"}}]}
             ],
             response_format={"type": "json_object"}
         )
         return json.loads(response.choices[0].message.content)
+
+    try:
+        return await scan_cache.get_or_compute(key, extract)
+    except HTTPException: raise
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 # --- [إصلاح] إضافة منشأة مع تشفير سليم ---
@@ -153,7 +220,7 @@ def create_place(payload: schemas.PlaceCreate, db: Session = Depends(get_db), x_
             raise HTTPException(status_code=400, detail="هذا البريد مسجل مسبقاً")
 
     # تشفير كلمة السر بشكل آمن
-    hashed_password = pwd_context.hash(payload.owner_password[:72]) if payload.owner_password else None
+    hashed_password = security.hash_password(payload.owner_password[:72]) if payload.owner_password else None
 
     # الحقن المصحح: استبعاد الباسورد والإيميل من القاموس لمنع التكرار
     data = payload.model_dump(exclude={"owner_password", "owner_email"})
@@ -173,83 +240,315 @@ def create_place(payload: schemas.PlaceCreate, db: Session = Depends(get_db), x_
     try:
         db.add(new_place)
         db.commit()
+        catalog.invalidate()
         db.refresh(new_place)
-        return new_place
+        out = schemas.PlaceAuthOut.model_validate(new_place)
+        # توكن جلسة لرفع الصور مباشرة بعد التسجيل
+        if new_place.owner_password: out.token = security.issue_token(new_place)
+        return out
     except Exception as e:
         db.rollback()
         print(f"Database Error: {e}")
         raise HTTPException(status_code=500, detail="حدث خطأ أثناء حفظ البيانات في القاعدة")
 
 # --- [إصلاح] جلب كافة الأماكن وحماية الخصوصية ---
+# حجم الدفعة التي نجلبها من القاعدة أثناء المرور على الأقرب فالأبعد
+NEAREST_BATCH = 64
+
+# الحقول المسموحة في fields= (العامة فقط، فلا تُطلب owner_password/owner_email بها) والأعمدة اللازمة دائماً لحساب الحالة والصلاحية والترتيب
+LIST_FIELDS = set(schemas.PlaceOut.model_fields)
+PLACE_ATTRS = set(Place.__mapper__.attrs.keys())
+ALWAYS_LOADED = {"id", "is_premium", "latitude", "longitude", "subscription_status", "subscription_end", "owner_password"}
+
+def _sort_key(premium: bool, distance: Optional[float], pid: int, rank: float = 0.0) -> tuple:
+    # مفتاح الترتيب الوحيد للقائمة: المميز أولاً، ثم الأقرب، ثم الأكثر صلة بالبحث، ثم رقم المكان
+    return (not premium, distance if distance is not None else NO_DISTANCE, rank, pid)
+
+def _encode_cursor(p_out, rank: float = 0.0) -> str:
+    raw = json.dumps([bool(p_out.is_premium), p_out.distance, p_out.id, rank], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        premium, distance, pid, *rank = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        rank = float(rank[0]) if rank else 0.0
+        return _sort_key(bool(premium), None if distance is None else float(distance), int(pid), rank)
+    except Exception:
+        raise HTTPException(status_code=400, detail="قيمة cursor غير صالحة")
+
+def _listing_bytes(body: dict, wanted: Optional[set]) -> bytes:
+    # نفس شكل PlacesResponse كما يرمزه FastAPI
+    items = [i.model_dump(mode="json", include=wanted) for i in body["items"]]
+    return json.dumps({**body, "items": items}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _nearest_places(query, db: Session, lat: float, lng: float, radius_km: Optional[float], limit: Optional[int], to_out, after: Optional[tuple] = None):
+    # البحث عن الأقرب عبر الفهرس الشبكي: نفس الترتيب (المميز أولاً ثم الأقرب)
+    # لكن بدون حساب المسافة لكل الأماكن ولا ترتيب القائمة كاملة
+    index = place_index.ensure(db)
+    results = []
+    for premium in (True, False):
+        tier = not premium
+        if after and tier < after[0]: continue
+        tier_after = after if after and tier == after[0] else None
+
+        candidates = index.iter_nearest(lat, lng, radius_km=radius_km, premium=premium)
+        if tier_after and tier_after[1] == NO_DISTANCE:
+            candidates = iter(())
+        elif tier_after:
+            # تخطي ما عُرض في الصفحات السابقة (المرشحون مرتبون بنفس مفتاح الـ cursor)
+            candidates = (c for c in candidates if (round(c[0], 2), c[1]) > (tier_after[1], tier_after[3]))
+        while True:
+            batch = [c for _, c in zip(range(NEAREST_BATCH), candidates)]
+            if not batch: break
+            dist = {pid: d for d, pid in batch}
+            rank = {pid: i for i, (_, pid) in enumerate(batch)}
+            outs = []
+            for p in query.filter(Place.id.in_(dist)).all():
+                p_out = to_out(p)
+                if p_out is None: continue
+                p_out.distance = round(dist[p.id], 2)
+                outs.append(p_out)
+            outs.sort(key=lambda o: rank[o.id])
+            results.extend(outs)
+            if limit and len(results) >= limit: return results[:limit]
+
+        # الأماكن بلا إحداثيات تأتي آخر فئتها (كما في الترتيب الكامل) إلا إذا طُلب نطاق محدد
+        if radius_km is None:
+            no_geo = query.filter(
+                Place.is_premium == premium,
+                or_(Place.latitude.is_(None), Place.longitude.is_(None)),
+            ).order_by(Place.id)
+            if tier_after and tier_after[1] == NO_DISTANCE: no_geo = no_geo.filter(Place.id > tier_after[3])
+            for p in (no_geo.limit(limit - len(results)) if limit else no_geo).all():
+                p_out = to_out(p)
+                if p_out is None: continue
+                results.append(p_out)
+    return results[:limit] if limit else results
+
+def _count_in_radius(db: Session, filters: list, lat: float, lng: float, radius_km: float) -> int:
+    # العدد داخل النطاق: المرشحون من الفهرس ثم عدّ مطابقي الفلاتر على دفعات
+    ids = [pid for _, pid in place_index.ensure(db).iter_nearest(lat, lng, radius_km=radius_km)]
+    return sum(
+        db.query(func.count(Place.id)).filter(*filters, Place.id.in_(ids[i:i + 500])).scalar()
+        for i in range(0, len(ids), 500)
+    )
+
 @app.get("/api/places", response_model=schemas.PlacesResponse)
 def get_all_places(
     q: Optional[str] = Query(None),
     cat: Optional[str] = Query(None),
     lat: Optional[float] = Query(None),
     lng: Optional[float] = Query(None),
+    radius_km: Optional[float] = Query(None, gt=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
     include_hidden: bool = Query(False),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     x_admin_token: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
     is_admin = (x_admin_token == ADMIN_SECRET_KEY)
-    # استخدام selectinload لضمان جلب كافة الصور لكل مكان دفعة واحدة
-    query = db.query(Place).options(joinedload(Place.images))
-
-    if cat: query = query.filter(Place.category == cat)
-    if q:
-        search = f"%{q.strip()}%"
-        query = query.filter(or_(Place.name.ilike(search), Place.area.ilike(search), Place.tags.ilike(search)))
-
-    items_db = query.all()
-    results = []
+    has_geo = lat is not None and lng is not None
+    after = _decode_cursor(cursor) if cursor else None
+
+    # fields= يحدد الحقول المطلوبة فقط (مثلاً id,name,category,distance لواجهات القوائم)
+    wanted = None
+    if fields:
+        wanted = {f.strip() for f in fields.split(",") if f.strip()} & LIST_FIELDS
+        wanted.add("id")
+
+    def page(items, total, ranks) -> dict:
+        # items فيها عنصر زائد عن limit إن وجدت صفحة تالية
+        next_cursor = None
+        if limit and len(items) > limit:
+            items = items[:limit]
+            next_cursor = _encode_cursor(items[-1], ranks.get(items[-1].id, 0.0))
+        return {"items": items, "total": total, "next_cursor": next_cursor}
+
+    def respond(items, total, ranks):
+        body = page(items, total, ranks)
+        # الترميز هنا بدل response_model حتى يُقاس وقته (نفس الناتج: التحقق كـ PlacesResponse ثم JSON)
+        with metrics.timer("serialize"):
+            if wanted is None:
+                return JSONResponse(schemas.PlacesResponse.model_validate(body).model_dump(mode="json"))
+            return JSONResponse({**body, "items": [i.model_dump(mode="json", include=wanted) for i in body["items"]]})
+
+    filters = []
+    if cat: filters.append(Place.category == cat)
+    # البحث عبر فهرس النص الكامل (FTS5 / tsvector) مع تطبيع الإملاء العربي
+    if q and search.backend is None: search.ensure_backend(db.connection())
+    match = search.match_subquery(q) if q else None
+    if match is not None:
+        filters.append(Place.id.in_(select(match.c.place_id)))
+    elif q:
+        # بدون فهرس نصي (أو نص بلا كلمات بعد التطبيع) نرجع للمطابقة القديمة
+        like = f"%{q.strip()}%"
+        filters.append(or_(Place.name.ilike(like), Place.area.ilike(like), Place.tags.ilike(like)))
+
+    # القوائم الشائعة للزائر (الكل أو حسب cat): بايتات JSON جاهزة مع ETag ونسخ مضغوطة مسبقاً
+    if not x_admin_token and not q and not has_geo and not cursor:
+        snap = catalog.get(db)
+        key = (cat or "", limit or 0, tuple(sorted(wanted)) if wanted else None)
+        with metrics.timer("serialize"):
+            enc = snap.encoded(key, lambda: _listing_bytes(page(*snap.select(cat=cat, limit=limit + 1 if limit else None)), wanted))
+        encoding, data, etag = enc.pick(accept_encoding)
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if enc.matches(if_none_match):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity": headers["Content-Encoding"] = encoding
+        return Response(data, media_type="application/json", headers=headers)
+
+    # الزائر بدون توكن: فلترة فوق نسخة الكتالوج العام في الذاكرة بدل استعلام الصفوف وبناء Pydantic
+    if not x_admin_token and (match is not None or not q):
+        ranks = dict(db.query(match.c.place_id, match.c.rank).all()) if match is not None else None
+        items, total, ranks = catalog.get(db).select(
+            cat=cat, ranks=ranks, lat=lat, lng=lng, radius_km=radius_km, after=after,
+            limit=limit + 1 if limit else None,
+        )
+        return respond(items, total, ranks)
+
+    # الإخفاء يتم في القاعدة نفسها: لا نجلب المعلق أو المنتهي إلا للأدمن أو لصاحب المكان
+    if not (include_hidden and is_admin):
+        # الحالة المخزنة تستخدم فهرس (status, category, premium)؛ شرط التاريخ يغطي ما انتهى منذ آخر تمريرة للماسح
+        visible = and_(
+            Place.subscription_status == "active",
+            Place.subscription_end >= datetime.utcnow(),
+        )
+        owner_pid = security.token_place_id(x_admin_token)
+        if owner_pid is not None: visible = or_(visible, Place.id == owner_pid)
+        filters.append(visible)
 
-    for p in items_db:
+    # استخدام selectinload لضمان جلب كافة الصور لكل مكان دفعة واحدة
+    if wanted is None:
+        options = [selectinload(Place.images)]
+    else:
+        cols = (wanted & PLACE_ATTRS | ALWAYS_LOADED) - {"images"}
+        options = [load_only(*[getattr(Place, c) for c in cols])]
+        options.append(selectinload(Place.images) if "images" in wanted else noload(Place.images))
+    query = db.query(Place).filter(*filters).options(*options)
+
+    def to_out(p: Place):
+        with metrics.timer("validate"):
+            return _to_out(p)
+
+    def _to_out(p: Place):
         try:
             status = get_place_status(p)
-            is_owner = (x_admin_token and p.owner_password and x_admin_token == p.owner_password)
+            is_owner = security.owner_matches(x_admin_token, p)
 
             if not (include_hidden and is_admin) and not is_owner:
-                if status in ("pending", "expired"): continue
+                if status in ("pending", "expired"): return None
 
             schema_model = schemas.PlaceAuthOut if (is_admin or is_owner) else schemas.PlaceOut
-            p_out = schema_model.model_validate(p)
+            if wanted is None:
+                p_out = schema_model.model_validate(p)
+            else:
+                # لا نلمس الأعمدة غير المحملة (مثل description) حتى لا تُجلب صفاً صفاً، وis_premium لازم للترتيب
+                p_out = schema_model.model_validate({f: getattr(p, f) for f in (wanted | {"is_premium"}) & PLACE_ATTRS}, from_attributes=True)
             
             p_out.subscription_status = status
             p_out.is_expired = (status == "expired")
-
-            # إصلاح حساب المسافة: التأكد من تحويل القيم لأرقام عشرية دقيقة
-            if lat is not None and lng is not None and p.latitude is not None and p.longitude is not None:
-                p_out.distance = calculate_haversine(float(lat), float(lng), float(p.latitude), float(p.longitude))
-            else:
-                p_out.distance = None
-            
-            results.append(p_out)
+            p_out.distance = None
+            return p_out
         except Exception as e:
             print(f"Error: {e}")
-            continue
-
-    # الترتيب: المميز أولاً، ثم الأقرب مسافة (99999 للأماكن التي بلا مسافة)
-    results.sort(key=lambda x: (not getattr(x, 'is_premium', False), x.distance if x.distance is not None else 99999))
-
-    return {"items": results, "total": len(results)}
+            return None
+
+    def count() -> int:
+        return db.query(func.count(Place.id)).filter(*filters).scalar()
+
+    page_size = limit + 1 if limit else None
+    ranks: dict = {}
+
+    # وضع الأقرب (k-nearest) أو البحث ضمن نطاق: الفهرس يقلّم المرشحين قبل حساب المسافات
+    if has_geo and (radius_km is not None or limit):
+        items = _nearest_places(query, db, float(lat), float(lng), radius_km, page_size, to_out, after)
+        if not limit:
+            total = len(items)
+        elif radius_km is not None:
+            total = _count_in_radius(db, filters, float(lat), float(lng), radius_km)
+        else:
+            total = count()
+
+    # صفحات بدون موقع: الترتيب (المميز ثم الصلة ثم الرقم) بالكامل في القاعدة مع keyset
+    elif not has_geo and limit:
+        if match is not None:
+            ordered = query.add_columns(match.c.rank).join(match, match.c.place_id == Place.id)
+            ordered = ordered.order_by(Place.is_premium.desc(), match.c.rank, Place.id)
+            in_tier = or_(match.c.rank > after[2], and_(match.c.rank == after[2], Place.id > after[3])) if after else None
+        else:
+            ordered = query.add_columns(literal(0.0)).order_by(Place.is_premium.desc(), Place.id)
+            in_tier = Place.id > after[3] if after else None
+        if after and not after[0]:
+            # الـ cursor داخل فئة المميز: بقية المميز ثم كل العادي
+            ordered = ordered.filter(or_(Place.is_premium.is_(False), in_tier))
+        elif after:
+            ordered = ordered.filter(Place.is_premium.is_(False), in_tier)
+        items = []
+        for p, rank in ordered.limit(page_size).all():
+            p_out = to_out(p)
+            if p_out is None: continue
+            ranks[p.id] = rank
+            items.append(p_out)
+        total = count()
+
+    else:
+        items, coords = [], []
+        for p in query.all():
+            p_out = to_out(p)
+            if p_out is None: continue
+            items.append(p_out)
+            coords.append((p.latitude, p.longitude))
+
+        # حساب كل المسافات والترتيب في تمريرة متجهة واحدة بدل حساب المسافة لكل صف
+        # (None للأماكن بلا إحداثيات، وتُرتب بعد غيرها كأن مسافتها 99999)
+        coords = np.array(coords, dtype=np.float64).reshape(-1, 2) if has_geo else None
+        dist = haversine_many(float(lat), float(lng), coords[:, 0], coords[:, 1]) if has_geo else np.full(len(items), np.nan)
+        for p_out, d in zip(items, round_km(dist)): p_out.distance = d
+
+        # صلة البحث تُستخدم فقط بدون موقع (مع الموقع الترتيب بالمسافة)
+        if match is not None and not has_geo:
+            ranks.update(db.query(match.c.place_id, match.c.rank).all())
+
+        # الترتيب: المميز أولاً، ثم الأقرب مسافة (99999 للأماكن التي بلا مسافة)، ثم الصلة، ثم الرقم
+        not_premium = np.array([not getattr(x, 'is_premium', False) for x in items], dtype=bool)
+        ids = np.array([x.id for x in items], dtype=np.int64)
+        rank_arr = np.array([ranks.get(x.id, 0.0) for x in items], dtype=np.float64)
+        order = np.lexsort((ids, rank_arr, np.nan_to_num(np.round(dist, 2), nan=NO_DISTANCE), not_premium)).tolist()
+        items = [items[i] for i in order]
+        total = len(items)
+        if after:
+            items = [x for x in items if _sort_key(x.is_premium, x.distance, x.id, ranks.get(x.id, 0.0)) > after]
+
+    return respond(items, total, ranks)
+
+# --- مزامنة تدريجية: ما تغير منذ رقم نسخة معين بدل إعادة تحميل الكتالوج كله ---
+@app.get("/api/places/changes", response_model=schemas.PlaceChangesResponse)
+def get_place_changes(since: int = Query(0, ge=0), db: Session = Depends(get_read_db)):
+    return changes.place_changes(db, since)
 
 # --- [إصلاح] تسجيل دخول المالك (التحقق العلمي) ---
-@app.post("/api/owner-login")
-def owner_login(data: dict, db: Session = Depends(get_db)):
+@app.post("/api/owner-login", dependencies=[Depends(limiter.limit("login"))])
+async def owner_login(data: dict, db: AsyncSession = Depends(get_async_db)):
     email = data.get("email", "").strip().lower()
     password = data.get("password", "").strip()
     
     # جلب المكان بناءً على البريد الإلكتروني
-    place = db.query(Place).filter(Place.owner_email == email).first()
+    place = (await db.execute(select(Place).filter(Place.owner_email == email))).scalars().first()
     
-    # الإصلاح: التحقق العلمي من كلمة السر المشفرة
-    if not place or not place.owner_password or not pwd_context.verify(password, place.owner_password):
+    # الإصلاح: التحقق العلمي من كلمة السر المشفرة (في عملية منفصلة، دون حجز الـ event loop)
+    if not place or not place.owner_password or not await security.averify_password(password, place.owner_password):
         raise HTTPException(status_code=401, detail="البريد الإلكتروني أو كلمة السر غير صحيحة")
 
+    token = security.issue_token(place)
     return {
         "place_id": place.id,
         "place_name": place.name,
-        "owner_password": place.owner_password,  # نرسل الهاش ليتم استخدامه كـ Token أمني
+        "token": token,  # توكن جلسة موقع وقصير العمر يُرسل في x-admin-token
+        "expires_in": security.SESSION_TTL_SECONDS,
+        "owner_password": token,  # للعملاء القدامى الذين يقرؤون هذا الحقل
         "subscription_status": get_place_status(place),
         "is_expired": is_expired(place)
     }
@@ -263,17 +562,14 @@ def update_place(place_id: int, payload: dict, db: Session = Depends(get_db), x_
 
     # --- 1. نظام التحقق المرن (Auth) ---
     is_admin = (x_admin_token == ADMIN_SECRET_KEY)
-    is_owner_hash = (x_admin_token and p.owner_password and x_admin_token == p.owner_password)
+    is_owner_token = security.owner_matches(x_admin_token, p)
     
-    # محاولة التحقق إذا كانت كلمة سر عادية (نص)
+    # محاولة التحقق إذا كانت كلمة سر عادية (نص)؛ توكن الجلسة المنتهي أو الخاطئ لا يكلف Argon2
     is_owner_raw = False
-    if x_admin_token and p.owner_password and not is_admin and not is_owner_hash:
-        try:
-            if pwd_context.verify(x_admin_token, p.owner_password):
-                is_owner_raw = True
-        except: pass
+    if x_admin_token and p.owner_password and not is_admin and not is_owner_token and not security.is_session_token(x_admin_token):
+        is_owner_raw = security.verify_password(x_admin_token, p.owner_password)
 
-    if not (is_admin or is_owner_hash or is_owner_raw):
+    if not (is_admin or is_owner_token or is_owner_raw):
         raise HTTPException(status_code=401, detail="كلمة السر غير صحيحة")
 
     # --- 2. تنظيف البيانات (منع خطأ 500) ---
@@ -287,16 +583,17 @@ def update_place(place_id: int, payload: dict, db: Session = Depends(get_db), x_
             if hasattr(p, key):
                 # التعامل مع كلمة المرور بذكاء
                 if key == "owner_password" and value:
-                    if value == p.owner_password: continue
-                    try:
-                        pwd_context.identify(str(value))
+                    # الهاش الحالي أو توكن الجلسة (ترسله لوحة المالك) لا يغيران كلمة السر
+                    if value == p.owner_password or security.owner_matches(str(value), p): continue
+                    if security.is_hash(str(value)):
                         setattr(p, key, value)
-                    except:
-                        setattr(p, key, pwd_context.hash(str(value)[:72]))
+                    else:
+                        setattr(p, key, security.hash_password(str(value)[:72]))
                 else:
                     setattr(p, key, value)
 
         db.commit()
+        catalog.invalidate()
         db.refresh(p)
         return p
     except Exception as e:
@@ -306,13 +603,14 @@ def update_place(place_id: int, payload: dict, db: Session = Depends(get_db), x_
 
 # --- [ميزة] المساعد الذكي ---
 class ChatRequest(BaseModel): message: str
-@app.post("/api/ai-guide")
-async def ramallah_ai_guide(req: ChatRequest, db: Session = Depends(get_db)):
-    if not client: return {"reply": "المساعد غير متاح."}
-    places = db.query(Place).filter(Place.subscription_status == "active").all()
-    context = "\n".join([f"- {p.name}: في {p.area}, {p.description}" for p in places])
+@app.post("/api/ai-guide", dependencies=[Depends(limiter.limit("ai"))])
+async def ramallah_ai_guide(req: ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    if not ai_client(): return {"reply": "المساعد غير متاح."}
+    # بدل إرسال كل الأماكن: أقرب k أماكن لنص الرسالة فقط (حجم الطلب ثابت مهما كبر الكتالوج)
+    index = await guide_index.aensure(db)
+    context = build_context(index.search(req.message))
     try:
-        res = client.chat.completions.create(
+        res = await ai_chat(
             model="gpt-4o",
             messages=[{"role": "system", "content": f"أنت مساعد رام الله تايم. استخدم البيانات: {context}"}, {"role": "user", "content": req.message}]
         )
@@ -320,25 +618,37 @@ async def ramallah_ai_guide(req: ChatRequest, db: Session = Depends(get_db)):
     except: return {"reply": "عذراً، حدث خطأ."}
 
 # --- إدارة الصور والاشتراكات ---
-@app.post("/api/places/{place_id}/images")
-async def upload_images(place_id: int, images: List[UploadFile]=File(...), db: Session=Depends(get_db), x_admin_token: str=Header(None)):
+@app.post("/api/places/{place_id}/images", dependencies=[Depends(limiter.limit("upload"))])
+async def upload_images(place_id: int, background: BackgroundTasks, images: List[UploadFile]=File(...), db: Session=Depends(get_db), x_admin_token: str=Header(None)):
     p = db.query(Place).filter(Place.id == place_id).first()
-    if not p or (x_admin_token != ADMIN_SECRET_KEY and x_admin_token != p.owner_password):
+    if not p or (x_admin_token != ADMIN_SECRET_KEY and not security.owner_matches(x_admin_token, p)):
         raise HTTPException(status_code=401)
-    for img in images:
-        fname = f"{uuid.uuid4()}.{img.filename.split('.')[-1]}"
-        with open(os.path.join(PLACE_IMAGES_DIR, fname), "wb") as f: f.write(await img.read())
-        db.add(PlaceImage(place_id=place_id, image_url=f"/images/places/{fname}"))
+    if len(images) > media.UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"الحد الأقصى {media.UPLOAD_MAX_FILES} صور في الطلب الواحد")
+    saved = []
+    try:
+        # كتابة كل ملف على دفعات بدل تحميله كاملاً في الذاكرة
+        for img in images: saved.append(await media.save_upload(img))
+    except Exception:
+        for url in saved: media.remove_file(url.lstrip("/"))
+        raise
+    new_images = [PlaceImage(place_id=place_id, image_url=url) for url in saved]
+    db.add_all(new_images)
     db.commit()
+    catalog.invalidate()
+    # النسخ المصغرة و WebP تُولد بعد إرسال الرد
+    background.add_task(media.build_variants, [i.id for i in new_images])
     return {"status": "ok"}
 
 @app.delete("/api/places/images/{image_id}")
 def delete_image(image_id: int, db: Session=Depends(get_db), x_admin_token: str=Header(None)):
     img = db.query(PlaceImage).filter(PlaceImage.id == image_id).first()
     p = db.query(Place).filter(Place.id == img.place_id).first() if img else None
-    if not img or (x_admin_token != ADMIN_SECRET_KEY and x_admin_token != p.owner_password):
+    if not img or (x_admin_token != ADMIN_SECRET_KEY and not security.owner_matches(x_admin_token, p)):
         raise HTTPException(status_code=401)
     db.delete(img); db.commit()
+    catalog.invalidate()
+    media.remove_image_files(img)
     return {"status": "ok"}
 
 @app.post("/api/places/{place_id}/activate")
@@ -350,12 +660,46 @@ def activate_place(place_id: int, data: dict, db: Session=Depends(get_db), x_adm
     p.subscription_status = "active"
     p.payment_total += float(data.get("amount", 0))
     db.commit()
+    catalog.invalidate()
     return {"status": "ok"}
 
 @app.get("/api/admin/verify")
 def verify_admin(x_admin_token: str=Header(None)):
     if x_admin_token != ADMIN_SECRET_KEY: raise HTTPException(status_code=401)
     return {"status": "ok"}
+
+@app.get("/api/admin/metrics")
+def admin_metrics(x_admin_token: str=Header(None)):
+    # صيغة Prometheus النصية (المقاييس لكل worker على حدة)
+    if x_admin_token != ADMIN_SECRET_KEY: raise HTTPException(status_code=401)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- استيراد/تصدير جماعي للأدمن (CSV أو NDJSON بالتدفق) ---
+def _bulk_format(fmt: Optional[str], content_type: Optional[str]) -> str:
+    fmt = (fmt or ("ndjson" if "json" in (content_type or "") else "csv")).lower()
+    if fmt not in ("csv", "ndjson"): raise HTTPException(status_code=400, detail="الصيغة المدعومة: csv أو ndjson")
+    return fmt
+
+@app.post("/api/admin/places/import")
+async def import_places(
+    request: Request,
+    format: Optional[str] = Query(None),
+    activate: bool = Query(True),
+    x_admin_token: str = Header(None),
+):
+    # جسم الطلب هو الملف نفسه (text/csv أو application/x-ndjson)، يُقرأ ويُدخل على دفعات
+    if x_admin_token != ADMIN_SECRET_KEY: raise HTTPException(status_code=401)
+    fmt = _bulk_format(format, request.headers.get("content-type"))
+    return await bulk.import_places(request.stream(), fmt, activate)
+
+@app.get("/api/admin/places/export")
+def export_places(format: str = Query("ndjson"), x_admin_token: str = Header(None)):
+    if x_admin_token != ADMIN_SECRET_KEY: raise HTTPException(status_code=401)
+    fmt = _bulk_format(format, None)
+    media_type = "text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="places.{fmt}"'}
+    return StreamingResponse(bulk.export_places(fmt), media_type=media_type, headers=headers)
+
 @app.delete("/api/places/{place_id}")
 def delete_place(place_id: int, db: Session = Depends(get_db), x_admin_token: Optional[str] = Header(None)):
     p = db.query(Place).filter(Place.id == place_id).first()
@@ -364,14 +708,17 @@ def delete_place(place_id: int, db: Session = Depends(get_db), x_admin_token: Op
 
     # التحقق من الصلاحية (أدمن أو صاحب المكان)
     is_admin = (x_admin_token == ADMIN_SECRET_KEY)
-    is_owner = (x_admin_token and p.owner_password and x_admin_token == p.owner_password)
+    is_owner = security.owner_matches(x_admin_token, p)
 
     if not is_admin and not is_owner:
         raise HTTPException(status_code=401, detail="غير مخول بالحذف")
 
     try:
+        images = list(p.images)
         db.delete(p)
         db.commit()
+        catalog.invalidate()
+        for img in images: media.remove_image_files(img)
         return {"status": "deleted"}
     except Exception as e:
         db.rollback()
@@ -0,0 +1,159 @@
+from __future__ import annotations
+import os
+import io
+import json
+import uuid
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal, PlaceImage
+from catalog import catalog
+
+# Pillow اختياري: بدونه تُحفظ الصور الأصلية فقط ولا تُنشأ نسخ مصغرة
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# --- إعدادات الرفع ---
+IMAGES_DIR = "images"
+PLACE_IMAGES_DIR = os.path.join(IMAGES_DIR, "places")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "10"))
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+# --- النسخ المشتقة (WebP) ---
+VARIANT_WIDTHS = tuple(int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1280").split(","))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+# حد أمان ضد الصور المضغوطة ذات الأبعاد الضخمة (decompression bomb)
+MAX_PIXELS = 40_000_000
+
+# صور /api/ai-scan تُصغر قبل base64: النموذج لا يحتاج أكثر من ~1024px لقراءة اللافتة
+AI_SCAN_MAX_SIDE = int(os.getenv("AI_SCAN_MAX_SIDE", "1024"))
+AI_SCAN_JPEG_QUALITY = int(os.getenv("AI_SCAN_JPEG_QUALITY", "85"))
+_MIME = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+
+# نتعرف على النوع من أول بايتات الملف وليس من الاسم أو content-type الذي يرسله المتصفح
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+def sniff_type(head: bytes) -> Optional[str]:
+    for sig, ext in _SIGNATURES:
+        if head.startswith(sig): return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP": return "webp"
+    return None
+
+def _url(path: str) -> str:
+    return "/" + path.replace(os.sep, "/")
+
+
+# --- الحفظ بالتدفق (chunks) ---
+async def save_upload(upload: UploadFile) -> str:
+    """يكتب الملف للقرص على دفعات صغيرة ويعيد رابطه؛ 415 للنوع غير المدعوم و 413 للحجم الزائد."""
+    head = await upload.read(UPLOAD_CHUNK_BYTES)
+    ext = sniff_type(head)
+    if not ext:
+        raise HTTPException(status_code=415, detail="نوع الصورة غير مدعوم (JPG, PNG, WebP, GIF فقط)")
+    path = os.path.join(PLACE_IMAGES_DIR, f"{uuid.uuid4()}.{ext}")
+    size = 0
+    f = await run_in_threadpool(open, path, "wb")
+    try:
+        chunk = head
+        while chunk:
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"حجم الصورة أكبر من {UPLOAD_MAX_BYTES // (1024 * 1024)}MB")
+            # الكتابة على القرص خارج الـ event loop
+            await run_in_threadpool(f.write, chunk)
+            chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        remove_file(path)
+        raise
+    await run_in_threadpool(f.close)
+    return _url(path)
+
+async def read_upload(upload: UploadFile) -> Tuple[bytes, str]:
+    """يقرأ الصورة للذاكرة على دفعات مع نفس حدود النوع والحجم؛ يعيد (البايتات، الامتداد)."""
+    head = await upload.read(UPLOAD_CHUNK_BYTES)
+    ext = sniff_type(head)
+    if not ext:
+        raise HTTPException(status_code=415, detail="نوع الصورة غير مدعوم (JPG, PNG, WebP, GIF فقط)")
+    parts, size, chunk = [], 0, head
+    while chunk:
+        size += len(chunk)
+        if size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"حجم الصورة أكبر من {UPLOAD_MAX_BYTES // (1024 * 1024)}MB")
+        parts.append(chunk)
+        chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+    return b"".join(parts), ext
+
+def downscale_for_ai(data: bytes, ext: str) -> Tuple[bytes, str]:
+    """يعيد (بايتات JPEG مصغرة، نوعها)؛ الأصل كما هو إن كان صغيراً أو تعذرت المعالجة."""
+    if Image is None: return data, _MIME[ext]
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if im.width * im.height > MAX_PIXELS: return data, _MIME[ext]
+            if max(im.size) <= AI_SCAN_MAX_SIDE and ext == "jpg": return data, _MIME[ext]
+            im = ImageOps.exif_transpose(im).convert("RGB")
+            im.thumbnail((AI_SCAN_MAX_SIDE, AI_SCAN_MAX_SIDE), Image.LANCZOS)
+            out = io.BytesIO()
+            im.save(out, "JPEG", quality=AI_SCAN_JPEG_QUALITY, optimize=True)
+        # لا نستبدل الأصل بنسخة أكبر منه
+        return (out.getvalue(), "image/jpeg") if out.tell() < len(data) else (data, _MIME[ext])
+    except Exception:
+        return data, _MIME[ext]
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def remove_image_files(img: PlaceImage) -> None:
+    # الأصل والنسخ المشتقة (الروابط بصيغة /images/places/...)
+    for url in [img.image_url, *(u for _, u in img.variant_list())]:
+        if url and url.startswith("/" + IMAGES_DIR + "/"): remove_file(url.lstrip("/"))
+
+
+# --- توليد النسخ (بعد إرسال الرد) ---
+def _render_variants(src: str) -> Tuple[int, int, List[list]]:
+    stem = os.path.splitext(src)[0]
+    with Image.open(src) as im:
+        if im.width * im.height > MAX_PIXELS: raise ValueError("image too large")
+        # صور الهواتف: تطبيق اتجاه EXIF قبل التصغير
+        im = ImageOps.exif_transpose(im)
+        im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB")
+        width, height = im.size
+        variants = []
+        # لا نكبر الصور الصغيرة: كل العروض الأصغر من الأصل + الأصل نفسه إن لم يكن ضمنها
+        widths = sorted({w for w in VARIANT_WIDTHS if w < width} | ({width} if width <= max(VARIANT_WIDTHS) else set()))
+        for w in widths:
+            out = f"{stem}_{w}.webp"
+            im.resize((w, max(1, round(height * w / width))), Image.LANCZOS).save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+            variants.append([w, _url(out)])
+    return width, height, variants
+
+def build_variants(image_ids: List[int]) -> None:
+    """يُشغّل كـ BackgroundTask: يولد نسخ WebP ويسجلها على PlaceImage."""
+    if Image is None or not image_ids: return
+    db = SessionLocal()
+    try:
+        for img in db.query(PlaceImage).filter(PlaceImage.id.in_(image_ids)).all():
+            src = img.image_url.lstrip("/")
+            try:
+                img.width, img.height, variants = _render_variants(src)
+                img.variants = json.dumps(variants)
+            except Exception as e:
+                # صورة تالفة أو غير قابلة للقراءة: يبقى الأصل فقط
+                print(f"--- [Warn] Image variants failed for {src}: {e} ---")
+        db.commit()
+        catalog.invalidate()
+    finally:
+        db.close()
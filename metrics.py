@@ -0,0 +1,221 @@
+from __future__ import annotations
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# الطلبات الأبطأ من هذا الحد تُطبع مع استعلاماتها (0 = معطل)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_QUERY_CHARS = 300
+
+# حدود الـ buckets بالثواني (من 1ms إلى 30s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Histogram بصيغة Prometheus (buckets تراكمية + sum + count) لكل مجموعة labels."""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, buckets
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None: s = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for key, counts, total, n in sorted(series):
+            base = _labels(self.labels, key)
+            acc = 0
+            for le, c in zip((*self.buckets, "+Inf"), counts):
+                acc += c
+                lines.append(f'{self.name}_bucket{_labels(self.labels, key, le=le)} {acc}')
+            lines.append(f"{self.name}_sum{base} {total}")
+            lines.append(f"{self.name}_count{base} {n}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in values]
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in values]
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: tuple, le=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None: pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# --- المقاييس ---
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Request latency until the last body byte.", ("method", "route"))
+# وقت كل مرحلة داخل الطلب (db, serialize, geo, argon2, openai) لمعرفة أين يذهب الوقت
+PHASE_LATENCY = Histogram("http_request_phase_seconds", "Time spent per phase inside a request.", ("route", "phase"))
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed, by route.", ("route",))
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "Single SQL statement latency.")
+ARGON2_LATENCY = Histogram("argon2_verify_duration_seconds", "Argon2 password verification latency (cache misses).")
+OPENAI_LATENCY = Histogram("openai_request_duration_seconds", "OpenAI chat completion latency.", ("model", "outcome"))
+OPENAI_QUEUE = Histogram("openai_queue_wait_seconds", "Wait for a free OpenAI concurrency slot.")
+RATE_LIMITED = Counter("rate_limited_total", "Requests rejected with 429, by route class and reason.", ("route_class", "reason"))
+# زمن إقلاع هذا الـ worker: import (من أول سطر في main.py حتى lifespan)، ثم مراحل lifespan
+STARTUP = Gauge("app_startup_seconds", "Worker cold-start time by phase.", ("phase",))
+
+REGISTRY = (REQUESTS, REQUEST_LATENCY, PHASE_LATENCY, DB_QUERIES, DB_QUERY_LATENCY, ARGON2_LATENCY, OPENAI_LATENCY, OPENAI_QUEUE, RATE_LIMITED, STARTUP)
+
+
+def render() -> str:
+    return "\n".join(line for m in REGISTRY for line in m.render()) + "\n"
+
+
+# --- سياق الطلب الحالي (ينتقل تلقائياً لخيوط الـ threadpool) ---
+class RequestStats:
+    __slots__ = ("phases", "db_queries", "queries", "done")
+
+    def __init__(self):
+        self.done = False
+        self.phases: Dict[str, float] = {}
+        self.db_queries = 0
+        self.queries: Optional[List[Tuple[float, str]]] = [] if SLOW_REQUEST_MS > 0 else None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def record(phase: str, seconds: float) -> None:
+    stats = _current.get()
+    if stats is not None and not stats.done: stats.add(phase, seconds)
+
+@contextmanager
+def timer(phase: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - t0)
+
+@contextmanager
+def startup_phase(phase: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP.set(time.perf_counter() - t0, phase)
+
+
+# --- أحداث SQLAlchemy: عدد الاستعلامات ووقتها لكل المحركات (المتزامن وغير المتزامن ونسخة القراءة) ---
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERY_LATENCY.observe(elapsed)
+    stats = _current.get()
+    # المهام الخلفية (BackgroundTasks) بعد إرسال الرد لا تُحسب على الطلب
+    if stats is None or stats.done: return
+    stats.add("db", elapsed)
+    stats.db_queries += 1
+    if stats.queries is not None: stats.queries.append((elapsed, statement[:SLOW_QUERY_CHARS]))
+
+@event.listens_for(Engine, "handle_error")
+def _on_error(exception_context) -> None:
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"): conn.info["query_start"].pop()
+
+
+class MetricsMiddleware:
+    """Middleware (ASGI خام، بدون BaseHTTPMiddleware) يقيس كل طلب HTTP حتى آخر بايت من الرد."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = [500]
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start": status[0] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                _finish(scope, stats, status[0], time.perf_counter() - t0)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not stats.done: _finish(scope, stats, status[0], time.perf_counter() - t0)
+            _current.reset(token)
+
+
+def _finish(scope, stats: RequestStats, status: int, elapsed: float) -> None:
+    stats.done = True
+    route = scope.get("route")
+    # قالب المسار (/api/places/{place_id}) وليس المسار الفعلي، حتى لا تنفجر الـ labels
+    label = getattr(route, "path", None) or "unmatched"
+    method = scope.get("method", "")
+    REQUESTS.inc(1, method, label, str(status))
+    REQUEST_LATENCY.observe(elapsed, method, label)
+    phases = stats.phases
+    for phase, seconds in phases.items(): PHASE_LATENCY.observe(seconds, label, phase)
+    if stats.db_queries: DB_QUERIES.inc(stats.db_queries, label)
+    if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+        path = scope.get("path", "") + ("?" + scope["query_string"].decode("latin-1") if scope.get("query_string") else "")
+        parts = ", ".join([f"{stats.db_queries} queries", *(f"{k}={v * 1000:.1f}ms" for k, v in phases.items())])
+        print(f"--- [Slow] {method} {path} {status} {elapsed * 1000:.1f}ms ({parts}) ---")
+        for seconds, sql in stats.queries or ():
+            print(f"    {seconds * 1000:8.2f}ms  {' '.join(sql.split())}")
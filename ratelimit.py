@@ -0,0 +1,188 @@
+from __future__ import annotations
+import os
+import math
+import time
+import sqlite3
+import itertools
+import threading
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+# ملف SQLite مشترك بين workers الـ gunicorn؛ بدونه الحالة في ذاكرة كل عملية
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB")
+# خلف nginx/Render: عنوان العميل الحقيقي هو أول قيمة في X-Forwarded-For
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+# حجز التزامن في المخزن المشترك ينتهي وحده إن مات الـ worker قبل تحريره
+LEASE_SECONDS = 120
+MAX_MEMORY_KEYS = 100_000
+
+
+class Policy:
+    """حد لكل فئة مسارات: token bucket لكل عميل (rate في الدقيقة + burst) وسقف تزامن عام للفئة."""
+
+    __slots__ = ("per_minute", "burst", "concurrency")
+
+    def __init__(self, per_minute: float, burst: int, concurrency: int):
+        self.per_minute, self.burst, self.concurrency = per_minute, burst, concurrency
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60.0
+
+    @classmethod
+    def from_env(cls, name: str, default: str) -> "Policy":
+        # RATE_LIMIT_AI="12:5:8" = 12 طلب/دقيقة، رصيد أولي 5، و 8 طلبات متزامنة كحد أقصى
+        per_minute, burst, concurrency = os.getenv(f"RATE_LIMIT_{name.upper()}", default).split(":")
+        return cls(float(per_minute), int(burst), int(concurrency))
+
+
+# فئات المسارات المكلفة: OpenAI، و Argon2، والكتابة على القرص
+POLICIES: Dict[str, Policy] = {
+    "ai": Policy.from_env("ai", "12:5:8"),
+    "login": Policy.from_env("login", "10:10:16"),
+    "upload": Policy.from_env("upload", "30:10:4"),
+}
+
+
+def _refill(tokens: float, updated: float, now: float, policy: Policy) -> Tuple[float, float]:
+    # يعيد (الرصيد الجديد، ثواني الانتظار)؛ الانتظار 0 يعني أن الطلب مقبول وخُصم منه توكن
+    tokens = min(policy.burst, tokens + (now - updated) * policy.rate)
+    if tokens >= 1: return tokens - 1, 0.0
+    return tokens, (1 - tokens) / policy.rate
+
+
+class MemoryStore:
+    """الحالة في ذاكرة العملية: كل worker يطبق الحدود وحده."""
+
+    blocking = False
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, policy: Policy) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (policy.burst, now))
+            tokens, wait = _refill(tokens, updated, now, policy)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_MEMORY_KEYS: self._prune(now)
+        return wait
+
+    def _prune(self, now: float) -> None:
+        # أقدم نصف المفاتيح: رصيدها امتلأ غالباً، وحذفها يعادل إعادتها لـ burst
+        for key, _ in sorted(self._buckets.items(), key=lambda kv: kv[1][1])[:len(self._buckets) // 2]:
+            del self._buckets[key]
+
+    def acquire(self, route_class: str, limit: int) -> Optional[object]:
+        with self._lock:
+            if self._active.get(route_class, 0) >= limit: return None
+            self._active[route_class] = self._active.get(route_class, 0) + 1
+        return route_class
+
+    def release(self, route_class: str, lease: object) -> None:
+        with self._lock:
+            self._active[route_class] -= 1
+
+
+class SqliteStore:
+    """حالة مشتركة بين العمليات في ملف SQLite؛ كل عملية داخل BEGIN IMMEDIATE فتبقى ذرية."""
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rate_leases (id INTEGER PRIMARY KEY, route_class TEXT NOT NULL, expires REAL NOT NULL)")
+        self._lock = threading.Lock()
+        self._calls = itertools.count()
+
+    def _tx(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(self._conn)
+                self._conn.execute("COMMIT")
+                return out
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def take(self, key: str, policy: Policy) -> float:
+        # وقت الساعة وليس monotonic: القيمة تُقارن بين عمليات مختلفة
+        now = time.time()
+
+        def fn(conn):
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, wait = _refill(*(row or (policy.burst, now)), now, policy)
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            # تنظيف دوري للعملاء الخاملين (رصيدهم ممتلئ على أي حال)
+            if next(self._calls) % 1000 == 0: conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - 3600,))
+            return wait
+        return self._tx(fn)
+
+    def acquire(self, route_class: str, limit: int) -> Optional[object]:
+        now = time.time()
+
+        def fn(conn):
+            conn.execute("DELETE FROM rate_leases WHERE expires < ?", (now,))
+            (active,) = conn.execute("SELECT COUNT(*) FROM rate_leases WHERE route_class = ?", (route_class,)).fetchone()
+            if active >= limit: return None
+            return conn.execute("INSERT INTO rate_leases (route_class, expires) VALUES (?, ?)", (route_class, now + LEASE_SECONDS)).lastrowid
+        return self._tx(fn)
+
+    def release(self, route_class: str, lease: object) -> None:
+        self._tx(lambda conn: conn.execute("DELETE FROM rate_leases WHERE id = ?", (lease,)))
+
+
+def client_key(request: Request) -> str:
+    # بالعنوان فقط وليس بـ x-admin-token: الحد يُطبق قبل التحقق من التوكن، فتوكن مزيف جديد لكل طلب كان يتجاوزه
+    forwarded = request.headers.get("x-forwarded-for") if RATE_LIMIT_TRUST_PROXY else None
+    ip = forwarded.split(",")[0].strip() if forwarded else (request.client.host if request.client else "")
+    return "ip:" + ip
+
+
+def _reject(route_class: str, reason: str, retry_after: float):
+    metrics.RATE_LIMITED.inc(1, route_class, reason)
+    raise HTTPException(
+        status_code=429,
+        detail="طلبات كثيرة، حاول بعد قليل",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class RateLimiter:
+    def __init__(self, store, policies: Dict[str, Policy], enabled: bool = True):
+        self.store, self.policies, self.enabled = store, policies, enabled
+
+    async def _call(self, fn, *args):
+        # المخزن المشترك يلمس القرص: خارج الـ event loop
+        return await run_in_threadpool(fn, *args) if self.store.blocking else fn(*args)
+
+    def limit(self, route_class: str):
+        """Dependency لـ FastAPI: ‏Depends(limiter.limit("ai")) يرفض بـ 429 + Retry-After عند تجاوز الحد."""
+        policy = self.policies[route_class]
+
+        async def dependency(request: Request):
+            if not self.enabled:
+                yield
+                return
+            wait = await self._call(self.store.take, f"{route_class}:{client_key(request)}", policy)
+            if wait > 0: _reject(route_class, "rate", wait)
+            lease = await self._call(self.store.acquire, route_class, policy.concurrency)
+            if lease is None: _reject(route_class, "concurrency", 1)
+            try:
+                yield
+            finally:
+                await self._call(self.store.release, route_class, lease)
+        return dependency
+
+
+limiter = RateLimiter(SqliteStore(RATE_LIMIT_DB) if RATE_LIMIT_DB else MemoryStore(), POLICIES, RATE_LIMIT_ENABLED)
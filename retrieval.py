@@ -0,0 +1,157 @@
+from __future__ import annotations
+import os
+import math
+import heapq
+import hashlib
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from database import Place, CatalogState
+from search import normalize_arabic, strip_prefix
+
+# عدد الأماكن التي تُرسل للنموذج مع كل رسالة
+TOP_K = int(os.getenv("AI_GUIDE_TOP_K", "8"))
+# الوصف يُقص في السياق (الاسم والمنطقة يكفيان غالباً)
+DESC_CHARS = int(os.getenv("AI_GUIDE_DESC_CHARS", "300"))
+
+# أوزان الحقول: الاسم أهم من الوسوم ثم التصنيف والمنطقة ثم الوصف
+FIELD_WEIGHTS = {"name": 3.0, "tags": 2.0, "category": 1.5, "area": 1.5, "description": 1.0}
+# المقاطع الحرفية (3 أحرف) تلتقط الجمع والتصريف والأخطاء الإملائية البسيطة بوزن أقل
+# (للحقول القصيرة فقط: الوصف الطويل يضخم الفهرس دون فائدة تذكر)
+NGRAM_FIELDS = ("name", "tags", "category", "area")
+NGRAM = 3
+NGRAM_WEIGHT = 0.3
+
+
+def _features(text: str, weight: float, out: Counter, ngrams: bool = True) -> None:
+    for word in normalize_arabic(text).split():
+        out["w:" + word] += weight
+        stem = strip_prefix(word)
+        if stem != word: out["w:" + stem] += weight
+        if not ngrams: continue
+        padded = f" {word} "
+        for i in range(len(padded) - NGRAM + 1):
+            out["g:" + padded[i:i + NGRAM]] += weight * NGRAM_WEIGHT
+
+
+def _doc_terms(fields: dict) -> Counter:
+    tf: Counter = Counter()
+    for f, w in FIELD_WEIGHTS.items():
+        if fields.get(f): _features(fields[f], w, tf, f in NGRAM_FIELDS)
+    return tf
+
+
+class GuideIndex:
+    """فهرس TF-IDF في الذاكرة لأماكن المساعد (lnc.ltc: وزن المستند لا يعتمد على idf).
+
+    لذلك إضافة/تعديل/حذف مكان يغير مدخلاته في الفهرس المعكوس وعدّاد df فقط،
+    دون إعادة حساب بقية المستندات. المزامنة بمقارنة بصمة نص كل مكان عند تغير
+    رقم نسخة الكتالوج، فلا يُعاد تحليل إلا الأماكن التي تغيرت فعلاً.
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._df: Counter = Counter()
+        self._docs: Dict[int, Tuple[str, list, dict]] = {}  # id -> (بصمة، المصطلحات، الحقول)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @staticmethod
+    def _fingerprint(fields: dict) -> str:
+        return hashlib.sha1("\0".join(str(fields.get(f) or "") for f in (*FIELD_WEIGHTS, "is_premium")).encode()).hexdigest()
+
+    def _remove(self, pid: int) -> None:
+        _, terms, _ = self._docs.pop(pid)
+        for t in terms:
+            posting = self._postings[t]
+            del posting[pid]
+            if not posting: del self._postings[t]
+            self._df[t] -= 1
+            if not self._df[t]: del self._df[t]
+
+    def _add(self, pid: int, fp: str, fields: dict) -> None:
+        tf = _doc_terms(fields)
+        weights = {t: 1.0 + math.log(c) if c >= 1 else c for t, c in tf.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for t, w in weights.items():
+            self._postings.setdefault(t, {})[pid] = w / norm
+            self._df[t] += 1
+        self._docs[pid] = (fp, list(weights), fields)
+
+    def upsert(self, pid: int, fields: dict) -> None:
+        fp = self._fingerprint(fields)
+        with self._lock:
+            old = self._docs.get(pid)
+            if old and old[0] == fp: return
+            if old: self._remove(pid)
+            self._add(pid, fp, fields)
+
+    def remove(self, pid: int) -> None:
+        with self._lock:
+            if pid in self._docs: self._remove(pid)
+
+    def sync(self, rows: Iterable[dict], version: Optional[int] = None) -> int:
+        """يطابق الفهرس مع الأماكن الحالية؛ يعيد عدد المستندات التي أعيد تحليلها."""
+        rows = list(rows)
+        changed = 0
+        with self._lock:
+            for r in rows:
+                current = self._docs.get(r["id"])
+                if current and current[0] == self._fingerprint(r): continue
+                self.upsert(r["id"], r)
+                changed += 1
+            alive = {r["id"] for r in rows}
+            for pid in [p for p in self._docs if p not in alive]:
+                self._remove(pid)
+                changed += 1
+            self.version = version
+        return changed
+
+    async def aensure(self, db) -> "GuideIndex":
+        # القراءة غير متزامنة (AsyncSession)، والتحليل في threadpool حتى لا يتوقف الـ event loop
+        version = (await db.execute(select(CatalogState.version).where(CatalogState.id == 1))).scalar() or 0
+        if version == self.version: return self
+        rows = (await db.execute(select(
+            Place.id, Place.name, Place.category, Place.area, Place.description, Place.tags, Place.is_premium
+        ).filter(Place.subscription_status == "active"))).mappings().all()
+        await run_in_threadpool(self.sync, [dict(r) for r in rows], version)
+        return self
+
+    def search(self, query: str, k: int = TOP_K) -> List[dict]:
+        """أفضل k أماكن للرسالة (تشابه cosine)؛ عند عدم وجود تطابق نعيد المميزة أولاً."""
+        q_tf: Counter = Counter()
+        _features(query, 1.0, q_tf)
+        with self._lock:
+            n = len(self._docs)
+            q = {}
+            for t, c in q_tf.items():
+                df = self._df.get(t)
+                if df: q[t] = (1.0 + math.log(c) if c >= 1 else c) * math.log((n + 1) / df)
+            scores: Dict[int, float] = {}
+            for t, qw in q.items():
+                for pid, dw in self._postings[t].items():
+                    scores[pid] = scores.get(pid, 0.0) + qw * dw
+            if scores:
+                best = heapq.nlargest(k, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+                return [self._docs[pid][2] for pid, _ in best]
+            docs = sorted(self._docs.items(), key=lambda kv: (not kv[1][2].get("is_premium"), kv[0]))
+            return [d[2] for _, d in docs[:k]]
+
+
+def build_context(places: List[dict]) -> str:
+    lines = []
+    for p in places:
+        desc = (p.get("description") or "")[:DESC_CHARS]
+        lines.append(f"- {p['name']}: في {p.get('area')}, {desc}")
+    return "\n".join(lines)
+
+
+# نسخة واحدة لكل عملية (worker)
+guide_index = GuideIndex()
@@ -0,0 +1,106 @@
+from __future__ import annotations
+import os
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import select, update, delete, func
+
+from database import AsyncSessionLocal, AIScanCache
+
+# حدود الكاش الدائم: عدد النتائج ومجموع حجمها (الأقدم استخداماً يُحذف أولاً)
+MAX_ENTRIES = int(os.getenv("AI_SCAN_CACHE_MAX_ENTRIES", "5000"))
+MAX_BYTES = int(os.getenv("AI_SCAN_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# نسخة صغيرة في ذاكرة كل worker أمام القاعدة
+MEMORY_ENTRIES = int(os.getenv("AI_SCAN_CACHE_MEMORY_ENTRIES", "256"))
+
+
+def content_key(data: bytes, *parts: str) -> str:
+    # البصمة تشمل النموذج والتعليمات: تغييرهما يبطل النتائج القديمة تلقائياً
+    h = hashlib.sha256()
+    for p in parts: h.update(p.encode() + b"\0")
+    h.update(data)
+    return h.hexdigest()
+
+
+class ScanCache:
+    """كاش LRU لنتائج استخراج البيانات من الصور، مع دمج الطلبات المتزامنة المتطابقة.
+
+    الطلب الثاني لنفس الصورة أثناء معالجة الأول ينتظر نفس المهمة بدل استدعاء
+    OpenAI مرة أخرى. الأخطاء لا تُحفظ، فالمحاولة التالية تعيد الاستدعاء.
+    """
+
+    def __init__(self):
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _remember(self, key: str, result: dict) -> None:
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > MEMORY_ENTRIES: self._memory.popitem(last=False)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.create_task(self._load_or_compute(key, compute))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: إلغاء أحد المنتظرين (انقطاع اتصاله) لا يلغي المهمة على البقية
+        return await asyncio.shield(task)
+
+    async def _load_or_compute(self, key: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+        cached = await self._load(key)
+        if cached is not None:
+            self._remember(key, cached)
+            return cached
+        result = await compute()
+        self._remember(key, result)
+        try:
+            await self._store(key, result)
+        except Exception as e:
+            # فشل الكاش لا يفشل الطلب
+            print(f"--- [Warn] AI scan cache store failed: {e} ---")
+        return result
+
+    @staticmethod
+    async def _load(key: str) -> Optional[dict]:
+        try:
+            async with AsyncSessionLocal() as db:
+                raw = (await db.execute(select(AIScanCache.result).where(AIScanCache.key == key))).scalar()
+                if raw is None: return None
+                await db.execute(update(AIScanCache).where(AIScanCache.key == key).values(
+                    hits=AIScanCache.hits + 1, last_used=datetime.utcnow()
+                ))
+                await db.commit()
+                return json.loads(raw)
+        except Exception as e:
+            print(f"--- [Warn] AI scan cache read failed: {e} ---")
+            return None
+
+    @staticmethod
+    async def _store(key: str, result: dict) -> None:
+        raw = json.dumps(result, ensure_ascii=False)
+        async with AsyncSessionLocal() as db:
+            await db.merge(AIScanCache(key=key, result=raw, size=len(raw.encode()), last_used=datetime.utcnow()))
+            await db.flush()
+            count, total = (await db.execute(select(func.count(), func.coalesce(func.sum(AIScanCache.size), 0)))).one()
+            if count > MAX_ENTRIES or total > MAX_BYTES:
+                # حذف الأقدم استخداماً حتى نعود تحت الحدين
+                doomed = []
+                rows = await db.stream(select(AIScanCache.key, AIScanCache.size).order_by(AIScanCache.last_used))
+                async for k, size in rows:
+                    if count <= MAX_ENTRIES and total <= MAX_BYTES: break
+                    doomed.append(k)
+                    count, total = count - 1, total - size
+                await rows.close()
+                if doomed: await db.execute(delete(AIScanCache).where(AIScanCache.key.in_(doomed)))
+            await db.commit()
+
+
+# نسخة واحدة لكل عملية (worker)
+scan_cache = ScanCache()
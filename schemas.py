@@ -7,6 +7,10 @@ class PlaceImageOut(BaseModel):
     id: int
     image_url: str
     caption: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    thumb_url: Optional[str] = None # أصغر نسخة WebP (لبطاقات القوائم)
+    srcset: Optional[str] = None # "url 320w, url 640w, ..." لـ <img srcset>
     model_config = ConfigDict(from_attributes=True)
 
 class PlaceBase(BaseModel):
@@ -55,8 +59,17 @@ class PlaceOut(BaseModel):
 
 class PlaceAuthOut(PlaceOut):
     owner_email: Optional[str] = None
-    owner_password: Optional[str] = None
+    # لا owner_password هنا: الهاش لا يخرج من السيرفر أبداً
+    token: Optional[str] = None # توكن جلسة المالك (عند الإنشاء فقط)
 
 class PlacesResponse(BaseModel):
     items: List[PlaceOut]
-    total: int
\ No newline at end of file
+    total: int
+    next_cursor: Optional[str] = None # يُرسل في ?cursor= لجلب الصفحة التالية
+
+class PlaceChangesResponse(BaseModel):
+    revision: int # يُرسل في ?since= في الطلب التالي
+    reset: bool = False # النسخة المحلية قديمة جداً: امسحها واستبدلها بـ changed
+    changed: List[PlaceOut] # أماكن جديدة أو معدلة (كاملة بصورها)
+    deleted: List[int] = [] # أماكن حُذفت أو لم تعد ظاهرة (منتهية/معلقة)
+    deleted_images: List[int] = []
\ No newline at end of file
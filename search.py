@@ -0,0 +1,199 @@
+from __future__ import annotations
+import re
+from typing import Optional
+
+from sqlalchemy import Float, Integer, event, inspect, text
+from sqlalchemy.engine import Engine
+
+from database import Place
+
+# --- تطبيع النص العربي ---
+# التشكيل (الفتحة.. السكون، الشدة، الألف الخنجرية) والتطويل
+_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_CHAR_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ة": "ه",
+    "ى": "ي", "ئ": "ي", "ؤ": "و",
+})
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+# أدوات التعريف والعطف الملتصقة بالكلمة (والمطعم، بالبيرة، للمقهى)
+_PREFIXES = ("وال", "بال", "فال", "كال", "لل", "ال")
+
+# الأوزان: الاسم أهم من الوسوم ثم المنطقة
+FIELDS = ("name", "area", "tags")
+FTS_WEIGHTS = (10.0, 2.0, 4.0)
+
+# يُرفع عند تغيير طريقة بناء نص الفهرس، فيُعاد بناؤه للقواعد القائمة
+INDEX_VERSION = 2
+
+# "fts5" أو "postgres"، أو None (نرجع لـ ILIKE القديم)؛ يُحدد عند init_search،
+# أو من القاعدة نفسها عند أول استخدام إن فشلت التهيئة في هذا الـ worker (ensure_backend)
+backend: Optional[str] = None
+
+
+def normalize_arabic(value: Optional[str]) -> str:
+    if not value: return ""
+    value = _DIACRITICS.sub("", value).translate(_CHAR_MAP).lower()
+    return " ".join(_NON_WORD.sub(" ", value).split())
+
+
+def strip_prefix(word: str) -> str:
+    # "القدس" -> "قدس"؛ يبقى حرفان على الأقل (فلا تتحول "الم" إلى "م")
+    for p in _PREFIXES:
+        if word.startswith(p) and len(word) - len(p) >= 2: return word[len(p):]
+    return word
+
+
+def _index_text(value: Optional[str]) -> str:
+    # FTS5 يطابق بدايات الكلمات فقط: نفهرس الكلمة كما هي وبدون "ال" أيضاً،
+    # فيجد "قدس" "مطعم القدس" وتبقى "القد" تطابق الكلمة الأصلية
+    words = normalize_arabic(value).split()
+    return " ".join(words + [s for s in map(strip_prefix, words) if s not in words])
+
+
+def _document(place: Place) -> dict:
+    return {f: _index_text(getattr(place, f)) for f in FIELDS}
+
+
+# --- إنشاء الفهرس ---
+def init_search(engine: Engine) -> None:
+    global backend
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == "sqlite":
+            try:
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5(name, area, tags, tokenize='unicode61')"
+                ))
+            except Exception as e:
+                print(f"--- [Warn] FTS5 unavailable, falling back to ILIKE: {e} ---")
+                return
+            indexed = conn.execute(text("SELECT count(*) FROM places_fts")).scalar()
+            backend = "fts5"
+        elif dialect == "postgresql":
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS place_search ("
+                " place_id INTEGER PRIMARY KEY REFERENCES places(id) ON DELETE CASCADE,"
+                " document TEXT NOT NULL,"
+                " tsv TSVECTOR NOT NULL)"
+            ))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_place_search_tsv ON place_search USING GIN (tsv)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_place_search_trgm ON place_search USING GIN (document gin_trgm_ops)"))
+            indexed = conn.execute(text("SELECT count(*) FROM place_search")).scalar()
+            backend = "postgres"
+        else:
+            return
+
+        conn.execute(text("CREATE TABLE IF NOT EXISTS search_state (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"))
+        version = conn.execute(text("SELECT version FROM search_state WHERE id = 1")).scalar()
+        # أول تشغيل (أو فهرس ناقص أو بصيغة قديمة): إعادة بناء كاملة من جدول الأماكن
+        if version != INDEX_VERSION or indexed != conn.execute(text("SELECT count(*) FROM places")).scalar():
+            reindex_all(conn)
+            conn.execute(text("DELETE FROM search_state"))
+            conn.execute(text("INSERT INTO search_state (id, version) VALUES (1, :v)"), {"v": INDEX_VERSION})
+
+
+def ensure_backend(conn) -> Optional[str]:
+    """backend لهذه العملية حتى لو لم تنجح init_search فيها: وجود جدول الفهرس في القاعدة يكفي.
+
+    المزامنة لا تتوقف في worker فشلت تهيئته بينما تبحث بقية الـ workers في الفهرس.
+    """
+    global backend
+    if backend is None:
+        dialect = conn.dialect.name
+        if dialect == "sqlite":
+            if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'places_fts'")).first(): backend = "fts5"
+        elif dialect == "postgresql":
+            if conn.execute(text("SELECT to_regclass('place_search')")).scalar(): backend = "postgres"
+    return backend
+
+
+def reindex_all(conn) -> None:
+    conn.execute(text("DELETE FROM places_fts" if backend == "fts5" else "DELETE FROM place_search"))
+    for r in conn.execute(text("SELECT id, name, area, tags FROM places")).mappings().all():
+        _upsert(conn, r["id"], {f: _index_text(r[f]) for f in FIELDS}, delete_first=False)
+
+
+def _upsert(conn, place_id: int, doc: dict, delete_first: bool = True) -> None:
+    if backend == "fts5":
+        if delete_first: conn.execute(text("DELETE FROM places_fts WHERE rowid = :id"), {"id": place_id})
+        conn.execute(text("INSERT INTO places_fts(rowid, name, area, tags) VALUES (:id, :name, :area, :tags)"), {"id": place_id, **doc})
+    elif backend == "postgres":
+        # الاسم بوزن A، الوسوم B، المنطقة C
+        conn.execute(text(
+            "INSERT INTO place_search(place_id, document, tsv) VALUES (:id, :document,"
+            " setweight(to_tsvector('simple', :name), 'A') || setweight(to_tsvector('simple', :tags), 'B')"
+            " || setweight(to_tsvector('simple', :area), 'C'))"
+            " ON CONFLICT (place_id) DO UPDATE SET document = EXCLUDED.document, tsv = EXCLUDED.tsv"
+        ), {"id": place_id, "document": " ".join(doc[f] for f in FIELDS if doc[f]), **doc})
+
+
+def _delete(conn, place_id: int) -> None:
+    if backend == "fts5":
+        conn.execute(text("DELETE FROM places_fts WHERE rowid = :id"), {"id": place_id})
+    elif backend == "postgres":
+        conn.execute(text("DELETE FROM place_search WHERE place_id = :id"), {"id": place_id})
+
+
+# --- المزامنة مع جدول الأماكن (نفس المعاملة الخاصة بالتعديل) ---
+@event.listens_for(Place, "after_insert")
+def _on_insert(mapper, conn, target) -> None:
+    if ensure_backend(conn): _upsert(conn, target.id, _document(target), delete_first=False)
+
+@event.listens_for(Place, "after_update")
+def _on_update(mapper, conn, target) -> None:
+    if not ensure_backend(conn): return
+    state = inspect(target)
+    if any(state.attrs[f].history.has_changes() for f in FIELDS):
+        _upsert(conn, target.id, _document(target))
+
+@event.listens_for(Place, "after_delete")
+def _on_delete(mapper, conn, target) -> None:
+    if ensure_backend(conn): _delete(conn, target.id)
+
+
+# --- الاستعلام ---
+def match_subquery(q: str):
+    """جدول فرعي (place_id, rank) للأماكن المطابقة؛ rank الأصغر هو الأكثر صلة.
+
+    يعيد None إذا لم يكن هناك فهرس أو كان النص فارغاً بعد التطبيع.
+    """
+    words = normalize_arabic(q).split()
+    if not backend or not words: return None
+    # بدون "ال" والحروف الملتصقة: "القدس" و "قدس" تطابقان نفس الكلمة المفهرسة
+    terms = [strip_prefix(w) for w in words]
+    if backend == "fts5":
+        # كل كلمة كبادئة بين علامتي تنصيص (تمنع تفسير رموز FTS5)
+        fts_q = " ".join('"' + t.replace('"', '""') + '"*' for t in terms)
+        weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+        stmt = text(
+            f"SELECT rowid AS place_id, bm25(places_fts, {weights}) AS rank FROM places_fts WHERE places_fts MATCH :q"
+        ).bindparams(q=fts_q)
+    else:
+        ts_q = " & ".join(t + ":*" for t in terms)
+        norm = " ".join(words)
+        stmt = text(
+            "SELECT place_id, -(ts_rank(tsv, to_tsquery('simple', :tsq)) + similarity(document, :norm)) AS rank"
+            " FROM place_search WHERE tsv @@ to_tsquery('simple', :tsq) OR document ILIKE :like"
+        ).bindparams(tsq=ts_q, norm=norm, like=f"%{norm}%")
+    return stmt.columns(place_id=Integer, rank=Float).subquery("search_match")
+
+
+if __name__ == "__main__":
+    # فحص سريع على قاعدة في الذاكرة: python search.py
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session
+    from database import Base
+
+    eng = create_engine("sqlite://")
+    Base.metadata.create_all(eng)
+    init_search(eng)
+    with Session(eng) as s:
+        s.add_all([Place(name=n, category="عام") for n in ("مطعم القدس", "مقهى الياسمين", "مخبز والقدس")])
+        s.commit()
+        cases = {"قدس": 2, "القدس": 2, "ياسمين": 1, "الياسمين": 1, "الياس": 1, "مقهى": 1}
+        for q, expected in cases.items():
+            found = s.execute(select(match_subquery(q).c.place_id)).all()
+            assert len(found) == expected, (q, found)
+    print(f"--- [OK] search ({backend}): {len(cases)} queries ---")
@@ -0,0 +1,184 @@
+from __future__ import annotations
+import os
+import time
+import hmac
+import base64
+import hashlib
+import asyncio
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+# --- إعدادات Argon2 (الكلفة قابلة للضبط حسب قوة السيرفر) ---
+ARGON2_PARAMS = {
+    "argon2__time_cost": int(os.getenv("ARGON2_TIME_COST", "3")),
+    "argon2__memory_cost": int(os.getenv("ARGON2_MEMORY_COST", "65536")),
+    "argon2__parallelism": int(os.getenv("ARGON2_PARALLELISM", "4")),
+}
+# عدد العمليات المخصصة للتشفير (0 = داخل نفس العملية)
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+
+# --- جلسات المالك الموقعة ---
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(12 * 3600)))
+SESSION_SECRET = os.getenv("SESSION_SECRET") or hashlib.sha256(
+    ("session:" + os.environ.get("ADMIN_SECRET_KEY", "ADMIN123123123")).encode()
+).hexdigest()
+TOKEN_PREFIX = "rt1."
+
+# نتائج التحقق الناجحة من كلمات السر الخام (حتى لا نعيد Argon2 لكل تعديل)
+VERIFY_CACHE_SECONDS = int(os.getenv("VERIFY_CACHE_SECONDS", "300"))
+VERIFY_CACHE_SIZE = 1024
+
+_pwd_context = None
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_verified: "OrderedDict[str, float]" = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def pwd_context():
+    # passlib يُستورد ويُبنى عند أول استخدام (وفي كل عملية من عمليات التشفير على حدة)
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["argon2"], deprecated="auto", **ARGON2_PARAMS)
+    return _pwd_context
+
+
+# --- التشفير في عمليات منفصلة (Argon2 ثقيل على المعالج والذاكرة) ---
+def _hash_worker(password: str) -> str:
+    return pwd_context().hash(password)
+
+def _verify_worker(password: str, hashed: str) -> bool:
+    try:
+        return pwd_context().verify(password, hashed)
+    except Exception:
+        return False
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if HASH_WORKERS <= 0: return None
+    if _pool is None:
+        with _pool_lock:
+            # spawn وليس fork: العملية الأب فيها خيوط (threadpool، asyncio) وأقفال قد تُنسخ مقفلة
+            if _pool is None: _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _cache_key(password: str, hashed: str) -> str:
+    return hashlib.sha256(f"{password}\0{hashed}".encode()).hexdigest()
+
+def _cached_ok(key: str) -> bool:
+    with _verified_lock:
+        exp = _verified.get(key)
+        if exp is None: return False
+        if exp < time.monotonic():
+            del _verified[key]
+            return False
+        _verified.move_to_end(key)
+        return True
+
+def _remember_ok(key: str) -> None:
+    with _verified_lock:
+        _verified[key] = time.monotonic() + VERIFY_CACHE_SECONDS
+        _verified.move_to_end(key)
+        while len(_verified) > VERIFY_CACHE_SIZE: _verified.popitem(last=False)
+
+def _observe_verify(seconds: float) -> None:
+    metrics.ARGON2_LATENCY.observe(seconds)
+    metrics.record("argon2", seconds)
+
+def hash_password(password: str) -> str:
+    pool = _get_pool()
+    return pool.submit(_hash_worker, password).result() if pool else _hash_worker(password)
+
+async def ahash_many(passwords: List[str]) -> List[str]:
+    # للاستيراد الجماعي: كل كلمات الدفعة موزعة على عمليات الـ pool بالتوازي
+    pool = _get_pool()
+    if not pool: return await run_in_threadpool(lambda: [_hash_worker(p) for p in passwords])
+    loop = asyncio.get_running_loop()
+    return list(await asyncio.gather(*(loop.run_in_executor(pool, _hash_worker, p) for p in passwords)))
+
+def verify_password(password: str, hashed: str) -> bool:
+    # للمسارات المتزامنة (تعمل أصلاً في threadpool)
+    key = _cache_key(password, hashed)
+    if _cached_ok(key): return True
+    pool = _get_pool()
+    t0 = time.perf_counter()
+    ok = pool.submit(_verify_worker, password, hashed).result() if pool else _verify_worker(password, hashed)
+    _observe_verify(time.perf_counter() - t0)
+    if ok: _remember_ok(key)
+    return ok
+
+async def averify_password(password: str, hashed: str) -> bool:
+    # للمسارات async: الانتظار لا يحجز الـ event loop ولا خيوط الـ threadpool
+    key = _cache_key(password, hashed)
+    if _cached_ok(key): return True
+    pool = _get_pool()
+    t0 = time.perf_counter()
+    if pool:
+        ok = await asyncio.get_running_loop().run_in_executor(pool, _verify_worker, password, hashed)
+    else:
+        # بدون pool (HASH_WORKERS=0): في الـ threadpool وليس على الـ event loop
+        ok = await run_in_threadpool(_verify_worker, password, hashed)
+    _observe_verify(time.perf_counter() - t0)
+    if ok: _remember_ok(key)
+    return ok
+
+def is_hash(value: str) -> bool:
+    try:
+        return pwd_context().identify(value) is not None
+    except Exception:
+        return False
+
+
+# --- توكن الجلسة: place_id + انتهاء + بصمة الهاش، موقع بـ HMAC ---
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _sign(payload: str) -> str:
+    return _b64(hmac.new(SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+
+def _fingerprint(hashed: Optional[str]) -> str:
+    # تغيير كلمة السر يبطل كل التوكنات القديمة
+    return hashlib.sha256((hashed or "").encode()).hexdigest()[:16]
+
+def issue_token(place) -> str:
+    payload = f"{place.id}:{int(time.time()) + SESSION_TTL_SECONDS}:{_fingerprint(place.owner_password)}"
+    return TOKEN_PREFIX + _b64(payload.encode()) + "." + _sign(payload)
+
+def is_session_token(value: Optional[str]) -> bool:
+    return bool(value) and value.startswith(TOKEN_PREFIX)
+
+def _read_token(token: Optional[str]) -> Optional[tuple]:
+    if not is_session_token(token): return None
+    try:
+        body, sig = token[len(TOKEN_PREFIX):].split(".", 1)
+        payload = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)).decode()
+        if not hmac.compare_digest(sig, _sign(payload)): return None
+        pid, exp, fp = payload.split(":")
+        if int(exp) < time.time(): return None
+        return int(pid), fp
+    except Exception:
+        return None
+
+def token_place_id(token: Optional[str]) -> Optional[int]:
+    data = _read_token(token)
+    return data[0] if data else None
+
+def owner_matches(token: Optional[str], place) -> bool:
+    """هل التوكن يخص صاحب هذا المكان؟ (توكن جلسة موقع فقط؛ الهاش نفسه لم يعد يُقبل كتوكن)"""
+    if not token or not place or not place.owner_password: return False
+    data = _read_token(token)
+    return bool(data) and data[0] == place.id and hmac.compare_digest(data[1], _fingerprint(place.owner_password))